@@ -8,27 +8,66 @@ Japan IR - yfinance 全項目取得スクリプト（並列処理版）
 """
 
 import argparse
+import io
+import json
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import time
 from datetime import datetime
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import namedtuple
 import threading
 
 INPUT_CSV = "data/japan_companies_latest.csv"
 OUTPUT_DIR = "output"
-MAX_WORKERS = 3  # 並列数（yfinance API制限対策）
+MAX_WORKERS = int(os.getenv("YF_MAX_WORKERS", "3"))  # 並列数
+RATE_LIMIT_PER_SEC = float(os.getenv("YF_RATE_PER_SEC", "3"))  # 全スレッド合計の秒間リクエスト数（yfinance API制限対策）
 MAX_RETRIES = 2
 RETRY_DELAY = 5
 PROGRESS_INTERVAL = 20
 BATCH_SIZE = 50  # バッチサイズ
 BATCH_DELAY = 45  # バッチ間の待機秒数
+CACHE_DIR = f"{OUTPUT_DIR}/cache"  # 取得成功データのキャッシュ（再実行時に再取得しない）
+CACHE_TTL_HOURS = float(os.getenv("YF_CACHE_TTL_HOURS", "6"))  # 0で無効
 
 # スレッドセーフなカウンター
 lock = threading.Lock()
 progress_counter = {"success": 0, "error": 0, "total": 0}
 
+
+# ============================================
+# レート制限（トークンバケット）
+# ============================================
+class RateLimiter:
+    """全スレッド共通のトークンバケット
+
+    並列数ではなく秒間リクエスト数でYahooへの負荷を制御する。
+    """
+
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.per / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_SEC)
+
 INFO_FIELDS = [
     "shortName", "longName", "symbol", "exchange", "currency",
     "country", "city", "address1", "website", "industry", "sector",
@@ -59,16 +98,87 @@ INFO_FIELDS = [
     "heldPercentInsiders", "heldPercentInstitutions",
 ]
 
-# Price Trend (MA乖離率) フィールド
+# Price Trend (MA乖離率) フィールド（calculate_ma_deviation の出力順）
 MA_FIELDS = [
-    "ma_5_value", "ma_5_deviation", "ma_5_trend",
-    "ma_25_value", "ma_25_deviation", "ma_25_trend",
-    "ma_75_value", "ma_75_deviation", "ma_75_trend",
-    "ma_200_value", "ma_200_deviation", "ma_200_trend",
+    f"ma_{period}_{kind}"
+    for period in [5, 25, 75, 200]
+    for kind in ["value", "deviation", "trend"]
 ]
 
+# 出力CSVの1行（dictではなくタプルでDataFrameを構築する）
+Row = namedtuple("Row", ["code", "ticker", *INFO_FIELDS, *MA_FIELDS, "status"])
+
+# fast_info（軽量なchartエンドポイント）で取得できるフィールド
+# INFO_FIELDS名 → fast_infoキー
+FAST_INFO_FIELDS = {
+    "currentPrice": "lastPrice",
+    "previousClose": "previousClose",
+    "open": "open",
+    "dayHigh": "dayHigh",
+    "dayLow": "dayLow",
+    "fiftyTwoWeekHigh": "yearHigh",
+    "fiftyTwoWeekLow": "yearLow",
+    "fiftyDayAverage": "fiftyDayAverage",
+    "twoHundredDayAverage": "twoHundredDayAverage",
+    "volume": "lastVolume",
+    "averageVolume": "threeMonthAverageVolume",
+    "averageVolume10days": "tenDayAverageVolume",
+    "marketCap": "marketCap",
+    "sharesOutstanding": "shares",
+    "currency": "currency",
+    "exchange": "exchange",
+}
+
+# 上場廃止か確認できなかった行のステータス接頭辞（errors CSVに出さず、自動下書き化の対象にしない）
+UNCONFIRMED_STATUS_PREFIX = "unconfirmed:"
+
+
+def download_batch_history(codes):
+    """バッチ単位で1年分の株価履歴を一括取得（MA計算用）
+
+    銘柄ごとに ticker.history() を呼ぶ代わりに yf.download() で
+    まとめて取得し、{code: DataFrame} を返す。失敗時は空dict。
+    一括取得に含まれなかった銘柄は呼び出し側で .info を確認してから個別取得する。
+    """
+    symbols = [f"{code}.T" for code in codes]
+    histories = {}
+
+    if not symbols:
+        return histories
 
-def calculate_ma_deviation(ticker, info):
+    try:
+        rate_limiter.acquire()
+        data = yf.download(
+            symbols,
+            period="1y",
+            interval="1d",
+            group_by="ticker",
+            auto_adjust=True,
+            progress=False,
+            threads=False,
+        )
+    except Exception:
+        return histories
+
+    if data is None or data.empty:
+        return histories
+
+    for code, symbol in zip(codes, symbols):
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            hist = data[symbol]
+        else:
+            # 1銘柄のみの場合はフラットなカラムで返る
+            hist = data
+        hist = hist.dropna(how="all")
+        if not hist.empty:
+            histories[code] = hist
+
+    return histories
+
+
+def calculate_ma_deviation(ticker, info, hist=None):
     """移動平均乖離率を計算"""
     result = {}
 
@@ -79,8 +189,10 @@ def calculate_ma_deviation(ticker, info):
         result[f"ma_{period}_trend"] = "neutral"
 
     try:
-        # 1年分の株価履歴を取得
-        hist = ticker.history(period="1y", interval="1d")
+        # 1年分の株価履歴を取得（バッチ取得済みでなければ個別取得）
+        if hist is None:
+            rate_limiter.acquire()
+            hist = ticker.history(period="1y", interval="1d")
 
         if hist is None or hist.empty:
             return result
@@ -106,30 +218,49 @@ def calculate_ma_deviation(ticker, info):
     return result
 
 
-def fetch_stock_data(code):
-    """単一企業のデータを取得"""
+def get_fast_info(ticker):
+    """fast_info から株価・出来高系フィールドのみ取得（.info を呼ばない）"""
+    fast_info = ticker.fast_info
+    info = {"symbol": ticker.ticker}
+
+    for field, key in FAST_INFO_FIELDS.items():
+        try:
+            info[field] = fast_info[key]
+        except Exception:
+            info[field] = None
+
+    return info
+
+
+def fetch_stock_data(code, hist=None, fast_only=False, info=None):
+    """単一企業のデータを取得
+
+    fast_only=True の場合は .info（quoteSummary）を呼ばず、
+    fast_info で取得できる株価系フィールドのみ更新する。
+    info を渡した場合は1回目の試行でそれを使う（取得済みの .info を再取得しない）。
+    """
     ticker_symbol = f"{code}.T"
 
     for attempt in range(MAX_RETRIES):
         try:
             ticker = yf.Ticker(ticker_symbol)
-            info = ticker.info
+            if info is None or attempt > 0:
+                rate_limiter.acquire()
+                info = get_fast_info(ticker) if fast_only else ticker.info
 
             if not info or len(info) <= 1:
                 raise Exception("Empty response")
 
-            # データを取得
-            data = {"code": code, "ticker": ticker_symbol}
-            for field in INFO_FIELDS:
-                data[field] = info.get(field)
+            # INFO_FIELDSの抽出は build_results_dataframe() で一括処理
+            data = {"code": code, "ticker": ticker_symbol, "_info": info}
 
             # Price Trend (MA乖離率) 計算
-            ma_data = calculate_ma_deviation(ticker, info)
+            ma_data = calculate_ma_deviation(ticker, info, hist)
             data.update(ma_data)
 
             # バリデーション: 株価・時価総額チェック
-            current_price = data.get("currentPrice")
-            market_cap = data.get("marketCap")
+            current_price = info.get("currentPrice")
+            market_cap = info.get("marketCap")
 
             has_valid_price = current_price and current_price > 0
             has_valid_market_cap = market_cap and market_cap > 0
@@ -148,12 +279,7 @@ def fetch_stock_data(code):
 
             # エラー時も取得できたデータは保存
             data = {"code": code, "ticker": ticker_symbol}
-            if 'info' in locals() and info:
-                for field in INFO_FIELDS:
-                    data[field] = info.get(field)
-            else:
-                for field in INFO_FIELDS:
-                    data[field] = None
+            data["_info"] = info if 'info' in locals() and info else None
 
             # MAフィールドもNullで初期化
             for period in [5, 25, 75, 200]:
@@ -165,18 +291,166 @@ def fetch_stock_data(code):
             return data
 
     # 最終エラー時もMAフィールドを含める
-    error_data = {"code": code, "ticker": ticker_symbol, "status": "error: Max retries"}
-    for field in INFO_FIELDS:
-        error_data[field] = None
+    return build_error_result(code, "error: Max retries")
+
+def build_error_result(code, status):
+    """info を取得していないエラー行（MAフィールドはNull）"""
+    error_data = {"code": code, "ticker": f"{code}.T", "_info": None, "status": status}
     for period in [5, 25, 75, 200]:
         error_data[f"ma_{period}_value"] = None
         error_data[f"ma_{period}_deviation"] = None
         error_data[f"ma_{period}_trend"] = "neutral"
     return error_data
 
-def process_company(code):
-    """並列処理用のラッパー関数"""
-    result = fetch_stock_data(code)
+def build_results_dataframe(results):
+    """取得結果をDataFrameに変換
+
+    各行を Row（code, ticker, INFO_FIELDS, MA/status の順のタプル）に
+    詰め替えてから、from_records のタプル経路で一括構築する。
+    """
+    rows = []
+    for r in results:
+        info = r.get("_info") or {}
+        rows.append(Row(
+            r.get("code"),
+            r.get("ticker"),
+            *(info.get(field) for field in INFO_FIELDS),
+            *(r.get(field) for field in MA_FIELDS),
+            r.get("status"),
+        ))
+
+    return pd.DataFrame.from_records(rows, columns=Row._fields)
+
+def format_csv_blocks(df_all, *frames):
+    """ヘッダー行と各DataFrameのCSV本文（ヘッダーなし）を文字列で返す
+
+    pyarrow があれば C++ の CSV ライターで整形し、なければ（または
+    型変換できない列があれば）pandas の to_csv にフォールバックする。
+    どちらで書いたかは標準出力に表示する。数値・文字列・欠損（空欄）は同じ形で出るが、
+    bool 列は pyarrow では true/false、pandas では True/False になり、
+    float の指数表記の桁も異なる場合がある（3_merge_data はどちらも読める）。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        pa = None
+
+    if pa is not None:
+        def to_text(df, include_header):
+            buffer = io.BytesIO()
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pacsv.write_csv(
+                table,
+                buffer,
+                write_options=pacsv.WriteOptions(include_header=include_header, quoting_style="needed"),
+            )
+            return buffer.getvalue().decode("utf-8")
+
+        try:
+            blocks = [to_text(df, False) for df in frames]
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            print(f"📝 CSV整形: pandas（pyarrowで変換できない列あり: {e}）")
+        else:
+            print("📝 CSV整形: pyarrow")
+            return (",".join(df_all.columns) + "\n", *blocks)
+    else:
+        print("📝 CSV整形: pandas（pyarrow未インストール）")
+
+    header = df_all.iloc[:0].to_csv(index=False)
+    return (header, *(df.to_csv(index=False, header=False) for df in frames))
+
+def write_csv_text(filepath, *parts):
+    """整形済みのCSV文字列を連結して書き込み（utf-8-sig）"""
+    with open(filepath, "w", encoding="utf-8-sig", newline="") as f:
+        for part in parts:
+            f.write(part)
+
+def load_cached_result(code, fast_only=False):
+    """TTL内に取得成功したキャッシュがあれば返す（なければNone）
+
+    fast_only で取得したキャッシュは全項目取得には使わない。
+    """
+    if CACHE_TTL_HOURS <= 0:
+        return None
+
+    cache_file = os.path.join(CACHE_DIR, f"{code}.json")
+
+    try:
+        age_hours = (time.time() - os.path.getmtime(cache_file)) / 3600
+        if age_hours > CACHE_TTL_HOURS:
+            return None
+
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get("fast_only") and not fast_only:
+        return None
+
+    return cached.get("result")
+
+
+def save_cached_result(code, result, fast_only=False):
+    """取得成功データをキャッシュに保存（infoはINFO_FIELDSのみ）"""
+    if CACHE_TTL_HOURS <= 0:
+        return
+
+    info = result.get("_info") or {}
+    cached_result = dict(result)
+    cached_result["_info"] = {field: info.get(field) for field in INFO_FIELDS}
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, f"{code}.json"), "w", encoding="utf-8") as f:
+            json.dump({"fast_only": fast_only, "result": cached_result}, f, ensure_ascii=False, default=str)
+    except (OSError, TypeError):
+        pass
+
+
+def has_info_data(info):
+    """info に symbol 以外の値が1つでもあるか（上場廃止銘柄の .info はほぼ空で返る）"""
+    return bool(info) and any(value is not None for key, value in info.items() if key != "symbol")
+
+
+def check_missing_history(code, fast_only=False):
+    """一括取得で履歴がなかった銘柄を確認
+
+    履歴がないのはレート制限・タイムアウトでも起きるため、それだけでは上場廃止と判定しない。
+    履歴の個別取得より先に .info（fast_only なら fast_info）を1回だけ呼び、
+    - 空なら上場廃止（error: delisted）
+    - 呼び出し自体が失敗したら確認できず（unconfirmed: 自動下書き化の対象外）
+    - 値があれば上場中なので、その info を使って通常どおり取得（履歴は個別取得）
+    """
+    ticker = yf.Ticker(f"{code}.T")
+    try:
+        rate_limiter.acquire()
+        info = get_fast_info(ticker) if fast_only else ticker.info
+    except Exception as e:
+        return build_error_result(code, f"{UNCONFIRMED_STATUS_PREFIX} {e}")
+
+    if not has_info_data(info):
+        return build_error_result(code, "error: delisted")
+
+    return fetch_stock_data(code, None, fast_only, info=info)
+
+
+def process_company(code, hist=None, fast_only=False, cached=None, missing_history=False):
+    """並列処理用のラッパー関数
+
+    missing_history=True（一括取得は成功したのに履歴がなかった銘柄）は
+    check_missing_history で上場廃止かを確認してから取得する。
+    """
+    if cached is not None:
+        result = cached
+    else:
+        if missing_history:
+            result = check_missing_history(code, fast_only)
+        else:
+            result = fetch_stock_data(code, hist, fast_only)
+        if result.get("status") == "success":
+            save_cached_result(code, result, fast_only)
 
     # スレッドセーフにカウンターを更新
     with lock:
@@ -188,13 +462,15 @@ def process_company(code):
 
     return result
 
-def main(skip=0, limit=None, suffix=""):
+def main(skip=0, limit=None, suffix="", fast_only=False):
     print("=" * 60)
     print("Japan IR - yfinance 全項目取得（並列処理版）")
     print("=" * 60)
     start_time = datetime.now()
     print(f"開始: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"並列数: {MAX_WORKERS}")
+    print(f"並列数: {MAX_WORKERS}（レート上限: {RATE_LIMIT_PER_SEC:g}件/秒）")
+    if fast_only:
+        print("モード: fast_info のみ（株価系フィールドのみ更新）")
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -229,9 +505,28 @@ def main(skip=0, limit=None, suffix=""):
     for batch_idx, batch in enumerate(batches, 1):
         print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
 
+        # キャッシュ済み（TTL内に取得成功）の銘柄は再取得しない
+        cached = {code: load_cached_result(code, fast_only) for code in batch}
+        cached_count = sum(1 for result in cached.values() if result is not None)
+        if cached_count:
+            print(f"    📦 キャッシュ使用: {cached_count}社")
+
+        # MA計算用の株価履歴をバッチ単位で一括取得
+        uncached_codes = [code for code in batch if cached[code] is None]
+        histories = download_batch_history(uncached_codes)
+
+        # 一括取得自体は成功したのに履歴がない銘柄は、.info で上場廃止かを確認してから取得
+        missing_history = set(uncached_codes) - set(histories) if histories else set()
+        if missing_history:
+            print(f"    🔍 履歴なし（上場廃止か確認）: {len(missing_history)}社")
+
         # 並列処理
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_code = {executor.submit(process_company, code): code for code in batch}
+            future_to_code = {
+                executor.submit(process_company, code, histories.get(code), fast_only, cached[code],
+                                code in missing_history): code
+                for code in batch
+            }
 
             for future in as_completed(future_to_code):
                 code = future_to_code[future]
@@ -256,31 +551,44 @@ def main(skip=0, limit=None, suffix=""):
                     print(f"[{current_total:4}/{total}] ✅ {progress_counter['success']} / ❌ {progress_counter['error']} | 経過: {elapsed/60:.1f}分 | ETA: {eta:.0f}分")
                     last_progress_print = current_total
 
-        # バッチ間の待機（最後のバッチ以外）
-        if batch_idx < total_batches:
+        # バッチ間の待機（最後のバッチ以外、全社キャッシュ使用時は不要）
+        if batch_idx < total_batches and cached_count < len(batch):
             print(f"    💤 {BATCH_DELAY}秒待機...")
             time.sleep(BATCH_DELAY)
 
     scrape_date = datetime.now().strftime('%Y-%m-%d')
-    for r in results:
-        r["scrape_date"] = scrape_date
 
-    df_results = pd.DataFrame(results)
+    df_results = build_results_dataframe(results)
+    df_results["scrape_date"] = scrape_date
+
+    # 成功/エラー/未確認の行をそれぞれ1回だけCSV整形し、全データはその連結で作る
+    # 未確認（上場廃止か確認できなかった）行は errors CSV に出さない
+    # （4_wordpress_smart_update の --auto-unpublish が errors CSV を下書き化の根拠にするため）
+    is_success = df_results["status"].eq("success").to_numpy()
+    is_unconfirmed = df_results["status"].str.startswith(UNCONFIRMED_STATUS_PREFIX).to_numpy()
+    df_success = df_results.iloc[np.flatnonzero(is_success)]
+    df_errors = df_results.iloc[np.flatnonzero(~is_success & ~is_unconfirmed)]
+    df_unconfirmed = df_results.iloc[np.flatnonzero(is_unconfirmed)]
+
+    csv_header, success_rows, error_rows, unconfirmed_rows = format_csv_blocks(
+        df_results, df_success, df_errors, df_unconfirmed
+    )
+
+    # fast_only は株価系以外の列が空なので、全項目取得（3_merge_data の入力）とは別名で出力
+    prefix = "yfinance_fast" if fast_only else "yfinance"
 
     # 全データ
-    output_file = f"{OUTPUT_DIR}/yfinance_all_fields_{scrape_date}{suffix}.csv"
-    df_results.to_csv(output_file, index=False, encoding="utf-8-sig")
+    output_file = f"{OUTPUT_DIR}/{prefix}_all_fields_{scrape_date}{suffix}.csv"
+    write_csv_text(output_file, csv_header, success_rows, error_rows, unconfirmed_rows)
 
     # 成功データのみ
-    df_success = df_results[df_results["status"] == "success"]
-    success_file = f"{OUTPUT_DIR}/yfinance_success_{scrape_date}{suffix}.csv"
-    df_success.to_csv(success_file, index=False, encoding="utf-8-sig")
+    success_file = f"{OUTPUT_DIR}/{prefix}_success_{scrape_date}{suffix}.csv"
+    write_csv_text(success_file, csv_header, success_rows)
 
     # エラーデータ
-    df_errors = df_results[df_results["status"] != "success"]
     if len(df_errors) > 0:
-        error_file = f"{OUTPUT_DIR}/yfinance_errors_{scrape_date}{suffix}.csv"
-        df_errors.to_csv(error_file, index=False, encoding="utf-8-sig")
+        error_file = f"{OUTPUT_DIR}/{prefix}_errors_{scrape_date}{suffix}.csv"
+        write_csv_text(error_file, csv_header, error_rows)
 
         print()
         print("=" * 60)
@@ -290,6 +598,10 @@ def main(skip=0, limit=None, suffix=""):
         for error_type, count in error_types.items():
             print(f"  {error_type}: {count}社")
 
+    if len(df_unconfirmed) > 0:
+        print()
+        print(f"⚠️ 上場廃止か確認できず（errors CSVには含めない）: {len(df_unconfirmed)}社")
+
     end_time = datetime.now()
     elapsed = (end_time - start_time).total_seconds()
 
@@ -312,5 +624,6 @@ if __name__ == "__main__":
     parser.add_argument("--skip", type=int, default=0, help="スキップする企業数")
     parser.add_argument("--limit", type=int, default=None, help="処理する企業数")
     parser.add_argument("--suffix", type=str, default="", help="出力ファイルのサフィックス（例: _part1）")
+    parser.add_argument("--fast-only", action="store_true", help="fast_infoのみ使用し株価系フィールドだけ取得（.infoを呼ばない）")
     args = parser.parse_args()
-    main(skip=args.skip, limit=args.limit, suffix=args.suffix)
+    main(skip=args.skip, limit=args.limit, suffix=args.suffix, fast_only=args.fast_only)
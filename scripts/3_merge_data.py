@@ -8,6 +8,7 @@ GitHub Actions対応版
 import pandas as pd
 import sys
 import os
+import shutil
 from datetime import datetime
 
 # ============================================================
@@ -22,16 +23,81 @@ YFINANCE_CSV = os.getenv('YFINANCE_CSV', 'output/yfinance_all_fields_latest.csv'
 OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'data')
 OUTPUT_FILENAME = 'integrated_company_data.csv'
 
+# 統合データ構造（出力カラム順）
+INTEGRATED_COLUMNS = [
+    # 基本識別情報
+    'code', 'ticker',
+    # 企業名（多言語）
+    'company_name_ja', 'company_name_en', 'short_name_en',
+    # 株価データ
+    'currentPrice', 'previousClose', 'open', 'dayHigh', 'dayLow',
+    # 時価総額・出来高
+    'marketCap', 'volume', 'averageVolume',
+    # 52週高値・安値
+    'fiftyTwoWeekHigh', 'fiftyTwoWeekLow',
+    # 企業情報
+    'sector', 'industry', 'country', 'city', 'website', 'fullTimeEmployees',
+    # 財務指標
+    'trailingPE', 'forwardPE', 'priceToBook',
+    'returnOnEquity', 'returnOnAssets', 'profitMargins',
+    # 配当
+    'dividendRate', 'dividendYield',
+    # 成長性（バブルチャート用）
+    'revenueGrowth',
+    # Price Trend (MA乖離率)
+    'ma_5_value', 'ma_5_deviation', 'ma_5_trend',
+    'ma_25_value', 'ma_25_deviation', 'ma_25_trend',
+    'ma_75_value', 'ma_75_deviation', 'ma_75_trend',
+    'ma_200_value', 'ma_200_deviation', 'ma_200_trend',
+    # メタ情報
+    'currency', 'exchange', 'scrape_date',
+]
+
+# 元カラム名 → 統合カラム名
+INTEGRATED_RENAMES = {
+    'company_name': 'company_name_ja',  # Yahoo JP
+    'longName': 'company_name_en',  # yfinance
+    'shortName': 'short_name_en',  # yfinance
+}
+
+# 元カラムが存在しない場合のデフォルト値（記載なしはNone）
+INTEGRATED_DEFAULTS = {
+    'company_name_en': '',
+    'short_name_en': '',
+    'sector': '',
+    'industry': '',
+    'country': '',
+    'city': '',
+    'website': '',
+    'ma_5_trend': '',
+    'ma_25_trend': '',
+    'ma_75_trend': '',
+    'ma_200_trend': '',
+    'currency': 'JPY',
+    'exchange': 'JPX',
+}
+
 # ============================================================
 # 関数定義
 # ============================================================
 
+def read_csv_fast(filepath):
+    """CSV読み込み（pyarrowがあればマルチスレッドパーサーを使用）
+
+    codeは先頭から文字列として読み込む（数値推論→str変換を避ける）
+    """
+    try:
+        return pd.read_csv(filepath, encoding='utf-8-sig', dtype={'code': str}, engine='pyarrow')
+    except ImportError:
+        return pd.read_csv(filepath, encoding='utf-8-sig', dtype={'code': str})
+
+
 def load_yahoo_jp_data(filepath):
     """Yahoo Japanのデータを読み込み"""
     print(f"📥 Yahoo JPデータ読み込み: {filepath}")
     
     try:
-        df = pd.read_csv(filepath, encoding='utf-8-sig')
+        df = read_csv_fast(filepath)
         
         # 必須カラムの確認
         required_columns = ['code', 'company_name']
@@ -41,7 +107,7 @@ def load_yahoo_jp_data(filepath):
             raise ValueError(f"必須カラムが見つかりません: {missing_columns}")
         
         # データ型を文字列に統一
-        df['code'] = df['code'].astype(str).str.strip()
+        df['code'] = df['code'].str.strip()
         df['company_name'] = df['company_name'].astype(str).str.strip()
         
         print(f"   ✅ 読み込み成功: {len(df)}社")
@@ -62,14 +128,14 @@ def load_yfinance_data(filepath):
     print(f"📥 yfinanceデータ読み込み: {filepath}")
     
     try:
-        df = pd.read_csv(filepath, encoding='utf-8-sig')
+        df = read_csv_fast(filepath)
         
         # codeカラムの確認
         if 'code' not in df.columns:
             raise ValueError("codeカラムが見つかりません")
         
         # データ型を文字列に統一
-        df['code'] = df['code'].astype(str).str.strip()
+        df['code'] = df['code'].str.strip()
         
         # 成功データのみフィルタリング
         if 'status' in df.columns:
@@ -96,13 +162,27 @@ def merge_data(yahoo_df, yfinance_df):
     """Yahoo JPとyfinanceデータを統合"""
     print("\n🔗 データ統合中...")
     
+    # 同一コードが複数行ある場合は最新（最後）の行を採用
+    duplicated = yfinance_df['code'].duplicated(keep='last')
+    if duplicated.any():
+        print(f"   ⚠️  yfinanceの重複コードを除外: {duplicated.sum()}行")
+        yfinance_df = yfinance_df[~duplicated]
+    
+    # 両側で共通のカテゴリ型にして、文字列ではなく整数コードで結合
+    code_dtype = pd.CategoricalDtype(
+        categories=pd.Index(yahoo_df['code'].dropna().unique()).union(yfinance_df['code'].dropna().unique())
+    )
+    
     # codeをキーに左結合（Yahoo JPをマスターに）
-    merged = yahoo_df.merge(
-        yfinance_df,
+    merged = yahoo_df.astype({'code': code_dtype}).merge(
+        yfinance_df.astype({'code': code_dtype}),
         on='code',
         how='left',
+        sort=False,
+        validate='many_to_one',
         suffixes=('_yahoo', '_yf')
     )
+    merged['code'] = merged['code'].astype(str)
     
     print(f"   統合後: {len(merged)}行")
     
@@ -121,75 +201,19 @@ def create_integrated_dataframe(merged_df):
     """統合データから最終的なDataFrameを作成"""
     print("\n📊 最終データ構造を作成中...")
     
-    # 統合データ構造
-    integrated = pd.DataFrame({
-        # 基本識別情報
-        'code': merged_df['code'],
-        'ticker': merged_df.get('ticker', merged_df['code'] + '.T'),
-        
-        # 企業名（多言語）
-        'company_name_ja': merged_df['company_name'],  # Yahoo JP
-        'company_name_en': merged_df.get('longName', ''),  # yfinance
-        'short_name_en': merged_df.get('shortName', ''),  # yfinance
-        
-        # 株価データ
-        'currentPrice': merged_df.get('currentPrice', None),
-        'previousClose': merged_df.get('previousClose', None),
-        'open': merged_df.get('open', None),
-        'dayHigh': merged_df.get('dayHigh', None),
-        'dayLow': merged_df.get('dayLow', None),
-        
-        # 時価総額・出来高
-        'marketCap': merged_df.get('marketCap', None),
-        'volume': merged_df.get('volume', None),
-        'averageVolume': merged_df.get('averageVolume', None),
-        
-        # 52週高値・安値
-        'fiftyTwoWeekHigh': merged_df.get('fiftyTwoWeekHigh', None),
-        'fiftyTwoWeekLow': merged_df.get('fiftyTwoWeekLow', None),
-        
-        # 企業情報
-        'sector': merged_df.get('sector', ''),
-        'industry': merged_df.get('industry', ''),
-        'country': merged_df.get('country', ''),
-        'city': merged_df.get('city', ''),
-        'website': merged_df.get('website', ''),
-        'fullTimeEmployees': merged_df.get('fullTimeEmployees', None),
-        
-        # 財務指標
-        'trailingPE': merged_df.get('trailingPE', None),
-        'forwardPE': merged_df.get('forwardPE', None),
-        'priceToBook': merged_df.get('priceToBook', None),
-        'returnOnEquity': merged_df.get('returnOnEquity', None),
-        'returnOnAssets': merged_df.get('returnOnAssets', None),
-        'profitMargins': merged_df.get('profitMargins', None),
-        
-        # 配当
-        'dividendRate': merged_df.get('dividendRate', None),
-        'dividendYield': merged_df.get('dividendYield', None),
-
-        # 成長性（バブルチャート用）
-        'revenueGrowth': merged_df.get('revenueGrowth', None),
-
-        # Price Trend (MA乖離率)
-        'ma_5_value': merged_df.get('ma_5_value', None),
-        'ma_5_deviation': merged_df.get('ma_5_deviation', None),
-        'ma_5_trend': merged_df.get('ma_5_trend', ''),
-        'ma_25_value': merged_df.get('ma_25_value', None),
-        'ma_25_deviation': merged_df.get('ma_25_deviation', None),
-        'ma_25_trend': merged_df.get('ma_25_trend', ''),
-        'ma_75_value': merged_df.get('ma_75_value', None),
-        'ma_75_deviation': merged_df.get('ma_75_deviation', None),
-        'ma_75_trend': merged_df.get('ma_75_trend', ''),
-        'ma_200_value': merged_df.get('ma_200_value', None),
-        'ma_200_deviation': merged_df.get('ma_200_deviation', None),
-        'ma_200_trend': merged_df.get('ma_200_trend', ''),
-
-        # メタ情報
-        'currency': merged_df.get('currency', 'JPY'),
-        'exchange': merged_df.get('exchange', 'JPX'),
-        'scrape_date': merged_df.get('scrape_date', datetime.now().strftime('%Y-%m-%d')),
-    })
+    # 統合データ構造（必要カラムを一括で切り出してリネーム）
+    source_of = {target: source for source, target in INTEGRATED_RENAMES.items()}
+    source_columns = [source_of.get(col, col) for col in INTEGRATED_COLUMNS]
+    integrated = merged_df.reindex(columns=source_columns).rename(columns=INTEGRATED_RENAMES)
+    
+    # 元カラムが存在しない場合のデフォルト値
+    for col, default in INTEGRATED_DEFAULTS.items():
+        if source_of.get(col, col) not in merged_df.columns:
+            integrated[col] = default
+    
+    integrated['ticker'] = integrated['ticker'].fillna(integrated['code'] + '.T')
+    if 'scrape_date' not in merged_df.columns:
+        integrated['scrape_date'] = datetime.now().strftime('%Y-%m-%d')
     
     # 統計情報
     total_rows = len(integrated)
@@ -204,7 +228,7 @@ def create_integrated_dataframe(merged_df):
 
 
 def save_integrated_data(df, output_dir, filename):
-    """統合データをCSVに保存"""
+    """統合データをCSV（+Parquet）に保存"""
     print(f"\n💾 データ保存中...")
     
     # 出力ディレクトリの作成
@@ -222,10 +246,20 @@ def save_integrated_data(df, output_dir, filename):
     df.to_csv(output_path, index=False, encoding='utf-8-sig')
     print(f"   ✅ 保存完了: {output_path}")
     
-    # 保存（タイムスタンプ版）
-    df.to_csv(timestamped_path, index=False, encoding='utf-8-sig')
+    # 保存（タイムスタンプ版）: 同一内容なので再整形せずコピー
+    shutil.copyfile(output_path, timestamped_path)
     print(f"   ✅ 保存完了: {timestamped_path}")
     
+    # 保存（Parquet版）: 後続処理の高速読み込み用（pyarrow等がなければスキップ）
+    parquet_path = output_path.replace('.csv', '.parquet')
+    try:
+        df.to_parquet(parquet_path, index=False, compression='zstd')
+        print(f"   ✅ 保存完了: {parquet_path}")
+    except ImportError:
+        print(f"   ⚠️  Parquet保存スキップ（pyarrow未インストール）")
+    except Exception as e:
+        print(f"   ⚠️  Parquet保存失敗: {e}")
+    
     # サンプルデータ表示
     print(f"\n📋 サンプルデータ（最初の3社）:")
     print(df[['code', 'company_name_ja', 'company_name_en', 'currentPrice', 'marketCap']].head(3).to_string(index=False))
@@ -10,12 +10,25 @@ WordPress企業データ スマート更新スクリプト
 """
 
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import logging
+import sys
+from logging.handlers import MemoryHandler
+import hashlib
+import json
+import threading
 import base64
 import time
 import os
 import argparse
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
 # ============================================================
 # 設定
@@ -34,116 +47,372 @@ if not WP_USER or not WP_PASSWORD:
 DEFAULT_CSV = 'data/integrated_company_data.csv'
 DEFAULT_ERRORS_CSV = 'output/yfinance_errors_latest.csv'
 
-# 処理速度（秒）
-REQUEST_DELAY = float(os.getenv('REQUEST_DELAY', '0.5'))
+# 処理速度（書き込みの並列数と、全スレッド合計の秒間リクエスト数）
+# Batch API では1リクエストが最大 WP_BATCH_SIZE 件の書き込みになるため、
+# サーバー側の書き込みは最大 WP_RATE_PER_SEC × WP_BATCH_SIZE 件/秒（既定 2 × 25 = 50件/秒）
+WP_CONCURRENCY = int(os.getenv('WP_CONCURRENCY', '2'))
+WP_RATE_PER_SEC = float(os.getenv('WP_RATE_PER_SEC', '2'))
+# サーバーの混雑通知（429 / Retry-After / X-RateLimit-Remaining）への対応
+RATE_LIMIT_BACKOFF = 5.0        # Retry-After が秒数でない場合の待機秒数
+RATE_LIMIT_MIN_REMAINING = 5    # 残りリクエスト数がこれ未満なら1秒分待機
+RATE_LIMIT_RETRIES = 2          # 429 で拒否されたPOSTの再送回数
+
+# 更新のBatch API送信件数（WordPressの上限は25件）
+WP_BATCH_SIZE = max(1, min(int(os.getenv('WP_BATCH_SIZE', '25')), 25))
+WP_BATCH_AVAILABLE = True
+_batch_lock = threading.Lock()
+BATCH_UNSUPPORTED = object()  # submit_batch の戻り値: Batch APIのルートがない（何も処理されていない）
+
+# 書き込みの種類ごとの表示名と集計キー
+OP_KINDS = {
+    'create': ('新規作成', 'created'),
+    'update': ('更新', 'updated'),
+    'unpublish': ('下書き化', 'unpublished'),
+}
+
+# 投稿metaに使う列（process_companies で型とNaNを一括で整える）
+MA_PERIODS = [5, 25, 75, 200]
+NUMERIC_FIELDS = [
+    'marketCap', 'currentPrice',
+    'trailingPE', 'priceToBook', 'dividendYield',
+    'forwardPE', 'returnOnEquity', 'returnOnAssets', 'profitMargins', 'revenueGrowth',
+    'previousClose', 'open', 'dayHigh', 'dayLow',
+    'fiftyTwoWeekHigh', 'fiftyTwoWeekLow',
+] + [f'ma_{period}_{kind}' for period in MA_PERIODS for kind in ('value', 'deviation')]
+INT_FIELDS = ['volume', 'averageVolume', 'fullTimeEmployees']
+STR_FIELDS = ['company_name_ja', 'company_name_en', 'sector', 'industry', 'website', 'city']
+TREND_FIELDS = [f'ma_{period}_trend' for period in MA_PERIODS]
+
+# 前回送信した更新データのハッシュ（内容が同じ企業は再送しない）
+META_HASH_CACHE = os.getenv('WP_META_HASH_CACHE', 'output/wp_meta_hash.json')
+
+# 投稿metaのキー → 整形済みCSV列の対応（順序は投稿データのキー順）
+META_COLUMNS = [
+    ('marketCap', 'marketCap_m'),
+    ('regularMarketPrice', 'currentPrice'),
+    ('DATE', 'scrape_date'),
+    ('company_name_ja', 'company_name_ja'),
+    ('longName', 'company_name_en'),
+    ('sector', 'sector'),
+    ('industry', 'industry'),
+    ('trailingPE', 'trailingPE'),
+    ('priceToBook', 'priceToBook'),
+    ('dividendYield', 'dividendYield'),
+    # 追加項目
+    ('forwardPE', 'forwardPE'),
+    ('returnOnEquity', 'returnOnEquity'),
+    ('returnOnAssets', 'returnOnAssets'),
+    ('profitMargins', 'profitMargins'),
+    ('revenueGrowth', 'revenueGrowth'),
+    ('previousClose', 'previousClose'),
+    ('open', 'open'),
+    ('dayHigh', 'dayHigh'),
+    ('dayLow', 'dayLow'),
+    ('volume', 'volume'),
+    ('averageVolume', 'averageVolume'),
+    ('fiftyTwoWeekHigh', 'fiftyTwoWeekHigh'),
+    ('fiftyTwoWeekLow', 'fiftyTwoWeekLow'),
+    ('website', 'website'),
+    ('city', 'city'),
+    ('fullTimeEmployees', 'fullTimeEmployees'),
+    # Price Trend (MA乖離率)
+] + [
+    (f'ma_{period}_{kind}', f'ma_{period}_{kind}')
+    for period in MA_PERIODS
+    for kind in ('value', 'deviation', 'trend')
+]
+META_KEYS = tuple(key for key, _ in META_COLUMNS)
+get_meta_values = itemgetter(*(column for _, column in META_COLUMNS))
+
+# 企業一覧取得（ページ並列数・安全装置）
+WP_PAGE_WORKERS = 8
+MAX_COMPANIES = 5000
+
+# ============================================================
+# ログ（企業ごとの進捗はバッファして出力）
+# ============================================================
+
+LOG_BUFFER_LINES = 200
+
+logger = logging.getLogger('wp_update')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter('%(message)s'))
+log_handler = MemoryHandler(LOG_BUFFER_LINES, flushLevel=logging.WARNING, target=_log_stream)
+logger.addHandler(log_handler)
+
+# ============================================================
+# HTTPセッション（Keep-Aliveで接続を再利用）
+# ============================================================
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    # 429/5xx はバックオフしつつ再試行（最終的な応答はそのまま返す）
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+))
+SESSION.headers['User-Agent'] = 'japan-ir-data/1.0'
+atexit.register(SESSION.close)
+
+# GET・POSTともHTTP/2で1接続に多重化（httpx[http2]がなければSESSIONを使用）
+# httpx には SESSION の Retry が効かないため、接続失敗はトランスポートで再試行し、
+# GET の 429/5xx は wp_get でバックオフしつつ再試行する
+WP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+WP_RETRY_BACKOFF = 0.5          # SESSION の Retry と同じ backoff_factor
+try:
+    import httpx
+    import h2  # noqa: F401  http2=True に必要
+    WP_CLIENT = httpx.Client(
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_connections=10)
+        ),
+        headers={'User-Agent': 'japan-ir-data/1.0'},
+        timeout=30
+    )
+    atexit.register(WP_CLIENT.close)
+    WP_BODY_KWARG = 'content'   # httpx はバイト列本文を content= で受け取る
+    WP_GET_RETRIES = 3
+except ImportError:
+    WP_CLIENT = SESSION
+    WP_BODY_KWARG = 'data'
+    WP_GET_RETRIES = 0          # SESSION は HTTPAdapter の Retry で再試行済み
+
+# JSONのデコード・エンコードはorjsonがあれば高速に処理
+try:
+    import orjson
+    json_loads = orjson.loads
+
+    def json_dumps(obj, sort_keys=False):
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option)
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj, sort_keys=False):
+        return json.dumps(obj, sort_keys=sort_keys).encode('utf-8')
 
 # ============================================================
 # WordPress認証
 # ============================================================
 
-def get_auth_headers():
-    """WordPress REST API認証ヘッダー"""
-    credentials = f"{WP_USER}:{WP_PASSWORD}"
-    token = base64.b64encode(credentials.encode()).decode('utf-8')
-    return {
-        'Authorization': f'Basic {token}',
-        'Content-Type': 'application/json'
-    }
+# 認証ヘッダーは起動時に1回だけ生成し、セッションにも保持させる
+_AUTH_HEADERS = {
+    'Authorization': 'Basic ' + base64.b64encode(f"{WP_USER}:{WP_PASSWORD}".encode()).decode('utf-8'),
+    'Content-Type': 'application/json'
+}
+SESSION.headers.update(_AUTH_HEADERS)
+WP_CLIENT.headers.update(_AUTH_HEADERS)
+
+# ============================================================
+# レート制限（トークンバケット）
+# ============================================================
+
+class RateLimiter:
+    """全スレッド共通のトークンバケット（time.sleep で1件ずつ待つ代わり）"""
+
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.per / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """サーバーから待機を指示されたら、全スレッドの送信をまとめて止める"""
+        with self._lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def observe(self, response):
+        """Retry-After / X-RateLimit-Remaining を見て、必要なときだけ待機を入れる"""
+        retry_after = response.headers.get('Retry-After')
+        if response.status_code == 429 or retry_after:
+            # 秒数以外（HTTP日付など）の場合は既定の待機時間
+            self.pause(float(retry_after) if retry_after and retry_after.isdigit() else RATE_LIMIT_BACKOFF)
+            return
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining and remaining.isdigit() and int(remaining) < RATE_LIMIT_MIN_REMAINING:
+            self.pause(self.per)
+
+
+rate_limiter = RateLimiter(WP_RATE_PER_SEC)
+
+def wp_post(url, json=None, **kwargs):
+    """レート制限付きでWordPressへPOST（JSON本文は json_dumps で事前にバイト列化）"""
+    if json is not None:
+        kwargs[WP_BODY_KWARG] = json_dumps(json)
+
+    # 待機はサーバーが混雑を通知したときだけ（429 は未処理なので待ってから再送）
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire()
+        response = WP_CLIENT.post(url, **kwargs)
+        rate_limiter.observe(response)
+        if response.status_code != 429:
+            break
+    return response
+
+def wp_get(url, **kwargs):
+    """WordPressへGET（429/5xx・通信エラーはバックオフしつつ再試行し、最終的な応答を返す）"""
+    for attempt in range(WP_GET_RETRIES + 1):
+        last_attempt = attempt == WP_GET_RETRIES
+        try:
+            response = WP_CLIENT.get(url, **kwargs)
+        except Exception:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in WP_RETRY_STATUSES or last_attempt:
+                return response
+        time.sleep(WP_RETRY_BACKOFF * (2 ** attempt))
 
 # ============================================================
 # WordPress企業取得
 # ============================================================
 
-def get_all_existing_companies(wp_url):
-    """WordPressから既存の全企業を取得（offsetベース）"""
-    headers = get_auth_headers()
-    existing_companies = {}
-    offset = 0
+def _get_companies_page(wp_url, page, per_page, lang=None):
+    """企業一覧の1ページ分を取得（id/slug/stock_codeのみ）"""
+    params = {
+        'per_page': per_page,
+        'page': page,
+        '_fields': 'id,slug,stock_code'
+    }
+    if lang:
+        params['lang'] = lang
+
+    return wp_get(
+        f"{wp_url}/wp-json/wp/v2/company",
+        params=params,
+        timeout=30
+    )
+
+
+def get_all_existing_companies(wp_url, lang=None):
+    """WordPressから既存の全企業を取得（pageベース、2ページ目以降は並列取得）
+
+    lang を指定するとその言語版（例: 'en'）の企業を取得する。
+    戻り値は ({証券コード: 投稿ID}, {証券コード: スラッグ})
+    """
     per_page = 100
+    max_pages = MAX_COMPANIES // per_page
+    lang_label = f"（{lang}）" if lang else ""
     
-    print("\n📥 WordPressから既存企業を取得中...")
+    print(f"\n📥 WordPressから既存企業{lang_label}を取得中...")
     
-    while True:
-        params = {
-            'per_page': per_page,
-            'offset': offset,
-            'context': 'edit'
-        }
+    # 1ページ目で総ページ数（X-WP-TotalPages）を確認
+    pages = []
+    response = _get_companies_page(wp_url, 1, per_page, lang)
+    
+    if response.status_code != 200:
+        print(f"   ⚠️  REST API エラー: ステータスコード {response.status_code}")
+    else:
+        pages.append((1, json_loads(response.content)))
         
-        response = requests.get(
-            f"{wp_url}/wp-json/wp/v2/company", 
-            params=params,
-            headers=headers,
-            timeout=30
-        )
+        # ヘッダーがなければ上限まで取得（空ページで終了）
+        total_pages = int(response.headers.get('X-WP-TotalPages', max_pages))
         
-        if response.status_code != 200:
-            print(f"   ⚠️  REST API エラー: ステータスコード {response.status_code}")
-            break
-            
-        companies = response.json()
+        # 安全装置（最大5,000社）
+        if total_pages > max_pages:
+            print(f"   ⚠️  安全装置: 5,000社で停止")
+            total_pages = max_pages
         
+        # 残りのページを並列取得（順序はページ順に保持）
+        page_numbers = list(range(2, total_pages + 1))
+        if page_numbers:
+            with ThreadPoolExecutor(max_workers=WP_PAGE_WORKERS) as executor:
+                responses = executor.map(
+                    lambda page: _get_companies_page(wp_url, page, per_page, lang),
+                    page_numbers
+                )
+                for page, page_response in zip(page_numbers, responses):
+                    if page_response.status_code != 200:
+                        print(f"   ⚠️  REST API エラー: ステータスコード {page_response.status_code}")
+                        break
+                    pages.append((page, json_loads(page_response.content)))
+    
+    all_rows = []
+    for page, companies in pages:
         # 空配列チェック
         if not companies or len(companies) == 0:
             break
         
         # デバッグ: 最初の1社だけ
-        if offset == 0 and len(existing_companies) == 0:
+        if page == 1 and len(all_rows) == 0:
             print(f"\n   🔍 デバッグ（最初の1社）:")
             print(f"      ID: {companies[0].get('id')}")
             print(f"      stock_code: '{companies[0].get('stock_code', '')}'")
             print()
         
-        for company in companies:
-            code = company.get('stock_code', '')
-            
-            if code:
-                # .T を除去
-                clean_code = str(code).replace('.T', '')
-                existing_companies[clean_code] = {
-                    'id': company['id'],
-                    'slug': company.get('slug', clean_code)
-                }
+        all_rows.extend(companies)
         
-        print(f"   取得済み: {len(existing_companies)}社（このバッチ: {len(companies)}社, offset: {offset}）")
+        print(f"   取得済み: {len(all_rows)}社（このバッチ: {len(companies)}社, page: {page}/{len(pages)}）")
         
         # 100未満で終了
         if len(companies) < per_page:
             break
-        
-        offset += per_page
-        
-        # 安全装置（最大5,000社）
-        if offset >= 5000:
-            print(f"   ⚠️  安全装置: 5,000社で停止")
-            break
     
-    print(f"   ✅ 既存企業取得完了: {len(existing_companies)}社\n")
+    # .T を除去してインデックス化（ベクトル演算）
+    df = pd.DataFrame(all_rows, columns=['id', 'slug', 'stock_code'])
+    df['code'] = df['stock_code'].astype('string').str.strip().str.removesuffix('.T')
+    df = df[df['code'].fillna('') != '']
+    df['slug'] = df['slug'].where(df['slug'].fillna('') != '', df['code'])
+    existing_ids = dict(zip(df['code'], df['id']))
+    existing_slugs = dict(zip(df['code'], df['slug']))
+    
+    print(f"   ✅ 既存企業{lang_label}取得完了: {len(existing_ids)}社\n")
     
     # デバッグ: 最初の10社を表示
-    if existing_companies:
+    if existing_ids:
         print("   🔍 デバッグ: 既存企業の最初の10社:")
-        for i, (code, info) in enumerate(list(existing_companies.items())[:10]):
-            print(f"      {code}: ID={info['id']}, slug={info['slug']}")
+        for code in list(existing_ids)[:10]:
+            print(f"      {code}: ID={existing_ids[code]}, slug={existing_slugs[code]}")
         print()
     
-    return existing_companies
+    return existing_ids, existing_slugs
 
+def load_translation_index(lang='en'):
+    """翻訳版の {証券コード: 投稿ID} インデックスを一括取得"""
+    existing_ids, _ = get_all_existing_companies(WP_URL, lang=lang)
+    return existing_ids
+
+@lru_cache(maxsize=None)
 def get_translation_by_ticker(ticker, target_lang='en'):
-    """証券コードから翻訳投稿を検索"""
+    """証券コードから翻訳投稿を検索（同じ企業は1回だけ問い合わせ）"""
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company"
     params = {
         'lang': target_lang,
         'stock_code': ticker,
-        'per_page': 100
+        'per_page': 100,
+        '_fields': 'id,stock_code'
     }
     
     try:
-        response = requests.get(url, params=params, headers=get_auth_headers())
+        response = wp_get(url, params=params, timeout=30)
         if response.status_code != 200:
             return None
             
-        companies = response.json()
+        companies = json_loads(response.content)
         
         # stock_codeが完全一致するものを探す
         for company in companies:
@@ -159,7 +428,10 @@ def get_translation_by_ticker(ticker, target_lang='en'):
 # ============================================================
 
 def create_company(company_data, status='publish', dry_run=False):
-    """新規企業ページ作成"""
+    """新規企業ページ作成の書き込みを作成（dry_run なら内容を表示）
+
+    戻り値: [(path, body, 成功ステータス)]（flush_pending_ops でまとめて送信）
+    """
     code = company_data.get('code', '')
     
     # Dry Run表示
@@ -169,526 +441,172 @@ def create_company(company_data, status='publish', dry_run=False):
         stock_price = company_data.get('currentPrice', 0)
         market_cap = company_data.get('marketCap', 0)
         
-        if pd.notna(market_cap) and market_cap > 0:
+        if market_cap > 0:
             market_cap_million = int(market_cap / 1000000)
         else:
             market_cap_million = 0
         
-        print(f"   スラッグ: company-{code}")
-        print(f"   URL: {WP_SITE_URL}/company/company-{code}/")
-        print(f"   企業名（日）: {company_name_ja}")
-        print(f"   企業名（英）: {company_name_en}")
-        print(f"   株価: {stock_price:,.0f}円" if pd.notna(stock_price) else "   株価: データなし")
-        print(f"   時価総額: {market_cap_million:,}百万円")
-        print(f"   ステータス: {status}")
-        return True
-    
-    # 実際の作成処理
-    headers = get_auth_headers()
-    url = f"{WP_SITE_URL}/wp-json/wp/v2/company"
+        logger.info(f"   スラッグ: company-{code}")
+        logger.info(f"   URL: {WP_SITE_URL}/company/company-{code}/")
+        logger.info(f"   企業名（日）: {company_name_ja}")
+        logger.info(f"   企業名（英）: {company_name_en}")
+        logger.info(f"   株価: {stock_price:,.0f}円" if stock_price else "   株価: データなし")
+        logger.info(f"   時価総額: {market_cap_million:,}百万円")
+        logger.info(f"   ステータス: {status}")
     
-    # 時価総額（百万円単位に変換）
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-    
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-    
-    # 企業名
-    company_name_ja = company_data.get('company_name_ja', '')
-    company_name_en = company_data.get('company_name_en', '')
-    
-    # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
-    
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-
-    # 財務指標
-    trailing_pe = company_data.get('trailingPE', 0)
-    price_to_book = company_data.get('priceToBook', 0)
-    dividend_yield = company_data.get('dividendYield', 0)
-
-    # 追加財務指標
-    forward_pe = company_data.get('forwardPE', 0)
-    return_on_equity = company_data.get('returnOnEquity', 0)
-    return_on_assets = company_data.get('returnOnAssets', 0)
-    profit_margins = company_data.get('profitMargins', 0)
-    revenue_growth = company_data.get('revenueGrowth', 0)
-    previous_close = company_data.get('previousClose', 0)
-    open_price = company_data.get('open', 0)
-    day_high = company_data.get('dayHigh', 0)
-    day_low = company_data.get('dayLow', 0)
-    volume = company_data.get('volume', 0)
-    average_volume = company_data.get('averageVolume', 0)
-    fifty_two_week_high = company_data.get('fiftyTwoWeekHigh', 0)
-    fifty_two_week_low = company_data.get('fiftyTwoWeekLow', 0)
-
-    # 会社基本情報
-    website = company_data.get('website', '')
-    city = company_data.get('city', '')
-    full_time_employees = company_data.get('fullTimeEmployees', 0)
-
-    # Price Trend (MA乖離率)
-    ma_5_value = company_data.get('ma_5_value', 0)
-    ma_5_deviation = company_data.get('ma_5_deviation', 0)
-    ma_5_trend = company_data.get('ma_5_trend', 'neutral')
-    ma_25_value = company_data.get('ma_25_value', 0)
-    ma_25_deviation = company_data.get('ma_25_deviation', 0)
-    ma_25_trend = company_data.get('ma_25_trend', 'neutral')
-    ma_75_value = company_data.get('ma_75_value', 0)
-    ma_75_deviation = company_data.get('ma_75_deviation', 0)
-    ma_75_trend = company_data.get('ma_75_trend', 'neutral')
-    ma_200_value = company_data.get('ma_200_value', 0)
-    ma_200_deviation = company_data.get('ma_200_deviation', 0)
-    ma_200_trend = company_data.get('ma_200_trend', 'neutral')
-
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    if pd.isna(company_name_ja):
-        company_name_ja = ''
-    if pd.isna(company_name_en):
-        company_name_en = ''
-    if pd.isna(trailing_pe):
-        trailing_pe = 0
-    else:
-        trailing_pe = float(trailing_pe)
-    if pd.isna(price_to_book):
-        price_to_book = 0
-    else:
-        price_to_book = float(price_to_book)
-    if pd.isna(dividend_yield):
-        dividend_yield = 0
-    else:
-        dividend_yield = float(dividend_yield)
-
-    # 追加項目のNaN対策
-    if pd.isna(forward_pe):
-        forward_pe = 0
-    else:
-        forward_pe = float(forward_pe)
-    if pd.isna(return_on_equity):
-        return_on_equity = 0
-    else:
-        return_on_equity = float(return_on_equity)
-    if pd.isna(return_on_assets):
-        return_on_assets = 0
-    else:
-        return_on_assets = float(return_on_assets)
-    if pd.isna(profit_margins):
-        profit_margins = 0
-    else:
-        profit_margins = float(profit_margins)
-    if pd.isna(revenue_growth):
-        revenue_growth = 0
-    else:
-        revenue_growth = float(revenue_growth)
-    if pd.isna(previous_close):
-        previous_close = 0
-    else:
-        previous_close = float(previous_close)
-    if pd.isna(open_price):
-        open_price = 0
-    else:
-        open_price = float(open_price)
-    if pd.isna(day_high):
-        day_high = 0
-    else:
-        day_high = float(day_high)
-    if pd.isna(day_low):
-        day_low = 0
-    else:
-        day_low = float(day_low)
-    if pd.isna(volume):
-        volume = 0
-    else:
-        volume = int(volume)
-    if pd.isna(average_volume):
-        average_volume = 0
-    else:
-        average_volume = int(average_volume)
-    if pd.isna(fifty_two_week_high):
-        fifty_two_week_high = 0
-    else:
-        fifty_two_week_high = float(fifty_two_week_high)
-    if pd.isna(fifty_two_week_low):
-        fifty_two_week_low = 0
-    else:
-        fifty_two_week_low = float(fifty_two_week_low)
-    if pd.isna(website):
-        website = ''
-    if pd.isna(city):
-        city = ''
-    if pd.isna(full_time_employees):
-        full_time_employees = 0
-    else:
-        full_time_employees = int(full_time_employees)
+    return [('/wp/v2/company', build_create_data(company_data, status), 201)]
 
-    # Price TrendのNaN対策
-    if pd.isna(ma_5_value):
-        ma_5_value = 0
-    else:
-        ma_5_value = float(ma_5_value)
-    if pd.isna(ma_5_deviation):
-        ma_5_deviation = 0
-    else:
-        ma_5_deviation = float(ma_5_deviation)
-    if pd.isna(ma_5_trend):
-        ma_5_trend = 'neutral'
-    if pd.isna(ma_25_value):
-        ma_25_value = 0
-    else:
-        ma_25_value = float(ma_25_value)
-    if pd.isna(ma_25_deviation):
-        ma_25_deviation = 0
-    else:
-        ma_25_deviation = float(ma_25_deviation)
-    if pd.isna(ma_25_trend):
-        ma_25_trend = 'neutral'
-    if pd.isna(ma_75_value):
-        ma_75_value = 0
-    else:
-        ma_75_value = float(ma_75_value)
-    if pd.isna(ma_75_deviation):
-        ma_75_deviation = 0
-    else:
-        ma_75_deviation = float(ma_75_deviation)
-    if pd.isna(ma_75_trend):
-        ma_75_trend = 'neutral'
-    if pd.isna(ma_200_value):
-        ma_200_value = 0
-    else:
-        ma_200_value = float(ma_200_value)
-    if pd.isna(ma_200_deviation):
-        ma_200_deviation = 0
-    else:
-        ma_200_deviation = float(ma_200_deviation)
-    if pd.isna(ma_200_trend):
-        ma_200_trend = 'neutral'
-
-    # 投稿データ
-    data = {
-        'title': str(company_name_ja),
+def build_create_data(company_data, status='publish'):
+    """新規作成用の投稿データを作成"""
+    code = company_data['code']
+    return {
+        'title': str(company_data['company_name_ja']),
         'slug': f'company-{code}',
         'status': status,
         'meta': {
             'Ticker': str(code),
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'company_name_ja': str(company_name_ja),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
-            'trailingPE': trailing_pe,
-            'priceToBook': price_to_book,
-            'dividendYield': dividend_yield,
-            # 追加項目
-            'forwardPE': forward_pe,
-            'returnOnEquity': return_on_equity,
-            'returnOnAssets': return_on_assets,
-            'profitMargins': profit_margins,
-            'revenueGrowth': revenue_growth,
-            'previousClose': previous_close,
-            'open': open_price,
-            'dayHigh': day_high,
-            'dayLow': day_low,
-            'volume': volume,
-            'averageVolume': average_volume,
-            'fiftyTwoWeekHigh': fifty_two_week_high,
-            'fiftyTwoWeekLow': fifty_two_week_low,
-            'website': str(website),
-            'city': str(city),
-            'fullTimeEmployees': full_time_employees,
-            # Price Trend (MA乖離率)
-            'ma_5_value': ma_5_value,
-            'ma_5_deviation': ma_5_deviation,
-            'ma_5_trend': str(ma_5_trend),
-            'ma_25_value': ma_25_value,
-            'ma_25_deviation': ma_25_deviation,
-            'ma_25_trend': str(ma_25_trend),
-            'ma_75_value': ma_75_value,
-            'ma_75_deviation': ma_75_deviation,
-            'ma_75_trend': str(ma_75_trend),
-            'ma_200_value': ma_200_value,
-            'ma_200_deviation': ma_200_deviation,
-            'ma_200_trend': str(ma_200_trend),
+            **build_company_meta(company_data)
         }
     }
 
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        return response.status_code == 201
-    except Exception as e:
-        return False
-
 # ============================================================
 # WordPress企業更新
 # ============================================================
 
-def update_single_post(post_id, company_data, lang='ja', dry_run=False):
-    """単一投稿を更新（言語指定可能）"""
-    headers = get_auth_headers()
-    url = f"{WP_SITE_URL}/wp-json/wp/v2/company/{post_id}"
+def build_company_meta(company_data):
+    """投稿metaを作成（company_data は prepare_company_frame で整形済みの行）"""
+    return dict(zip(META_KEYS, get_meta_values(company_data)))
 
-    # 時価総額（百万円単位に変換）
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-
-    # 企業名
-    company_name_ja = company_data.get('company_name_ja', '')
-    company_name_en = company_data.get('company_name_en', '')
-
-    # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
-
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-
-    # 財務指標
-    trailing_pe = company_data.get('trailingPE', 0)
-    price_to_book = company_data.get('priceToBook', 0)
-    dividend_yield = company_data.get('dividendYield', 0)
-
-    # 追加財務指標
-    forward_pe = company_data.get('forwardPE', 0)
-    return_on_equity = company_data.get('returnOnEquity', 0)
-    return_on_assets = company_data.get('returnOnAssets', 0)
-    profit_margins = company_data.get('profitMargins', 0)
-    revenue_growth = company_data.get('revenueGrowth', 0)
-    previous_close = company_data.get('previousClose', 0)
-    open_price = company_data.get('open', 0)
-    day_high = company_data.get('dayHigh', 0)
-    day_low = company_data.get('dayLow', 0)
-    volume = company_data.get('volume', 0)
-    average_volume = company_data.get('averageVolume', 0)
-    fifty_two_week_high = company_data.get('fiftyTwoWeekHigh', 0)
-    fifty_two_week_low = company_data.get('fiftyTwoWeekLow', 0)
-
-    # 会社基本情報
-    website = company_data.get('website', '')
-    city = company_data.get('city', '')
-    full_time_employees = company_data.get('fullTimeEmployees', 0)
 
-    # Price Trend (MA乖離率)
-    ma_5_value = company_data.get('ma_5_value', 0)
-    ma_5_deviation = company_data.get('ma_5_deviation', 0)
-    ma_5_trend = company_data.get('ma_5_trend', 'neutral')
-    ma_25_value = company_data.get('ma_25_value', 0)
-    ma_25_deviation = company_data.get('ma_25_deviation', 0)
-    ma_25_trend = company_data.get('ma_25_trend', 'neutral')
-    ma_75_value = company_data.get('ma_75_value', 0)
-    ma_75_deviation = company_data.get('ma_75_deviation', 0)
-    ma_75_trend = company_data.get('ma_75_trend', 'neutral')
-    ma_200_value = company_data.get('ma_200_value', 0)
-    ma_200_deviation = company_data.get('ma_200_deviation', 0)
-    ma_200_trend = company_data.get('ma_200_trend', 'neutral')
-
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    if pd.isna(company_name_ja):
-        company_name_ja = ''
-    if pd.isna(company_name_en):
-        company_name_en = ''
-    if pd.isna(trailing_pe):
-        trailing_pe = 0
-    else:
-        trailing_pe = float(trailing_pe)
-    if pd.isna(price_to_book):
-        price_to_book = 0
-    else:
-        price_to_book = float(price_to_book)
-    if pd.isna(dividend_yield):
-        dividend_yield = 0
-    else:
-        dividend_yield = float(dividend_yield)
+def build_update_data(company_data):
+    """更新用の投稿データ（meta）を作成"""
+    return {'meta': build_company_meta(company_data)}
 
-    # 追加項目のNaN対策
-    if pd.isna(forward_pe):
-        forward_pe = 0
-    else:
-        forward_pe = float(forward_pe)
-    if pd.isna(return_on_equity):
-        return_on_equity = 0
-    else:
-        return_on_equity = float(return_on_equity)
-    if pd.isna(return_on_assets):
-        return_on_assets = 0
-    else:
-        return_on_assets = float(return_on_assets)
-    if pd.isna(profit_margins):
-        profit_margins = 0
-    else:
-        profit_margins = float(profit_margins)
-    if pd.isna(revenue_growth):
-        revenue_growth = 0
-    else:
-        revenue_growth = float(revenue_growth)
-    if pd.isna(previous_close):
-        previous_close = 0
-    else:
-        previous_close = float(previous_close)
-    if pd.isna(open_price):
-        open_price = 0
-    else:
-        open_price = float(open_price)
-    if pd.isna(day_high):
-        day_high = 0
-    else:
-        day_high = float(day_high)
-    if pd.isna(day_low):
-        day_low = 0
-    else:
-        day_low = float(day_low)
-    if pd.isna(volume):
-        volume = 0
-    else:
-        volume = int(volume)
-    if pd.isna(average_volume):
-        average_volume = 0
-    else:
-        average_volume = int(average_volume)
-    if pd.isna(fifty_two_week_high):
-        fifty_two_week_high = 0
-    else:
-        fifty_two_week_high = float(fifty_two_week_high)
-    if pd.isna(fifty_two_week_low):
-        fifty_two_week_low = 0
-    else:
-        fifty_two_week_low = float(fifty_two_week_low)
-    if pd.isna(website):
-        website = ''
-    if pd.isna(city):
-        city = ''
-    if pd.isna(full_time_employees):
-        full_time_employees = 0
-    else:
-        full_time_employees = int(full_time_employees)
 
-    # Price TrendのNaN対策
-    if pd.isna(ma_5_value):
-        ma_5_value = 0
-    else:
-        ma_5_value = float(ma_5_value)
-    if pd.isna(ma_5_deviation):
-        ma_5_deviation = 0
-    else:
-        ma_5_deviation = float(ma_5_deviation)
-    if pd.isna(ma_5_trend):
-        ma_5_trend = 'neutral'
-    if pd.isna(ma_25_value):
-        ma_25_value = 0
-    else:
-        ma_25_value = float(ma_25_value)
-    if pd.isna(ma_25_deviation):
-        ma_25_deviation = 0
-    else:
-        ma_25_deviation = float(ma_25_deviation)
-    if pd.isna(ma_25_trend):
-        ma_25_trend = 'neutral'
-    if pd.isna(ma_75_value):
-        ma_75_value = 0
-    else:
-        ma_75_value = float(ma_75_value)
-    if pd.isna(ma_75_deviation):
-        ma_75_deviation = 0
-    else:
-        ma_75_deviation = float(ma_75_deviation)
-    if pd.isna(ma_75_trend):
-        ma_75_trend = 'neutral'
-    if pd.isna(ma_200_value):
-        ma_200_value = 0
-    else:
-        ma_200_value = float(ma_200_value)
-    if pd.isna(ma_200_deviation):
-        ma_200_deviation = 0
-    else:
-        ma_200_deviation = float(ma_200_deviation)
-    if pd.isna(ma_200_trend):
-        ma_200_trend = 'neutral'
+def submit_batch(ops):
+    """REST Batch API（/wp-json/batch/v1）で複数の書き込みをまとめて送信
 
-    # 更新データ
-    data = {
-        'meta': {
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'company_name_ja': str(company_name_ja),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
-            'trailingPE': trailing_pe,
-            'priceToBook': price_to_book,
-            'dividendYield': dividend_yield,
-            # 追加項目
-            'forwardPE': forward_pe,
-            'returnOnEquity': return_on_equity,
-            'returnOnAssets': return_on_assets,
-            'profitMargins': profit_margins,
-            'revenueGrowth': revenue_growth,
-            'previousClose': previous_close,
-            'open': open_price,
-            'dayHigh': day_high,
-            'dayLow': day_low,
-            'volume': volume,
-            'averageVolume': average_volume,
-            'fiftyTwoWeekHigh': fifty_two_week_high,
-            'fiftyTwoWeekLow': fifty_two_week_low,
-            'website': str(website),
-            'city': str(city),
-            'fullTimeEmployees': full_time_employees,
-            # Price Trend (MA乖離率)
-            'ma_5_value': ma_5_value,
-            'ma_5_deviation': ma_5_deviation,
-            'ma_5_trend': str(ma_5_trend),
-            'ma_25_value': ma_25_value,
-            'ma_25_deviation': ma_25_deviation,
-            'ma_25_trend': str(ma_25_trend),
-            'ma_75_value': ma_75_value,
-            'ma_75_deviation': ma_75_deviation,
-            'ma_75_trend': str(ma_75_trend),
-            'ma_200_value': ma_200_value,
-            'ma_200_deviation': ma_200_deviation,
-            'ma_200_trend': str(ma_200_trend),
-        }
+    ops: [(path, body, 成功ステータス), ...]（最大 WP_BATCH_SIZE 件）
+    戻り値: 各書き込みの成否リスト。
+    ルートがない（404/405・rest_no_route）場合は BATCH_UNSUPPORTED、
+    タイムアウト・5xx・解釈できない応答など結果が不明な場合は None
+    """
+    url = f"{WP_SITE_URL}/wp-json/batch/v1"
+    payload = {
+        'validation': 'normal',
+        'requests': [
+            {'method': 'POST', 'path': path, 'body': body}
+            for path, body, _ in ops
+        ]
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        return response.status_code == 200
+        response = wp_post(url, json=payload, timeout=60)
+    except Exception as e:
+        return None
+
+    # プロキシ・メンテナンス画面などJSONでない本文や、想定外の形も結果不明として扱う
+    try:
+        body = json_loads(response.content)
+    except ValueError:
+        body = None
+
+    if response.status_code in (404, 405) or (isinstance(body, dict) and body.get('code') == 'rest_no_route'):
+        return BATCH_UNSUPPORTED
+
+    if response.status_code != 207 and response.status_code != 200:
+        return None
+
+    responses = body.get('responses') if isinstance(body, dict) else None
+    if not isinstance(responses, list) or len(responses) != len(ops):
+        return None
+
+    return [
+        isinstance(r, dict) and r.get('status') == expected
+        for r, (_, _, expected) in zip(responses, ops)
+    ]
+
+
+def is_create_op(expected):
+    """201 Created を期待する書き込み（新規作成）か。同じ内容で再送すると投稿が重複する"""
+    return expected == 201
+
+
+def send_single(path, body, expected):
+    """1件ずつ送信（Batch APIが使えない・結果が不明な場合のフォールバック）"""
+    try:
+        response = wp_post(f"{WP_SITE_URL}/wp-json{path}", json=body, timeout=30)
+        return response.status_code == expected
     except Exception as e:
         return False
 
 
-def update_company(post_id, company_data, existing_slug='', dry_run=False):
-    """既存企業ページ更新（多言語対応）"""
-    code = company_data.get('code', '')
+def send_chunk(chunk):
+    """1チャンク分を送信（Batch API優先、使えなければ1件ずつ）
+
+    Batch APIを無効にするのはルートがない場合だけ（一時的な失敗ではこのチャンクのみ1件ずつ送信）。
+    結果が不明なバッチはサーバー側で処理済みの可能性があるため、
+    冪等でない新規作成は再送せず失敗として扱う（次回実行時に既存判定される）。
+    """
+    global WP_BATCH_AVAILABLE
+
+    results = submit_batch(chunk) if WP_BATCH_AVAILABLE else BATCH_UNSUPPORTED
+    if isinstance(results, list):
+        return results
+
+    if results is BATCH_UNSUPPORTED:
+        with _batch_lock:
+            if WP_BATCH_AVAILABLE:
+                logger.warning("   ⚠️  Batch API利用不可: 1件ずつ送信します")
+                WP_BATCH_AVAILABLE = False
+        return [send_single(path, body, expected) for path, body, expected in chunk]
+
+    logger.warning("   ⚠️  Batch API送信失敗（結果不明）: 更新・下書き化のみ1件ずつ再送します（新規作成は再送しません）")
+    return [
+        False if is_create_op(expected) else send_single(path, body, expected)
+        for path, body, expected in chunk
+    ]
+
+
+def flush_pending_ops(pending, stats, meta_hashes=None):
+    """キューに溜めた書き込み（新規作成・更新・下書き化）を一括送信して結果を集計
+
+    pending: [(kind, ticker, company_name, [(path, body, 成功ステータス), ...], digest), ...]
+    WP_BATCH_SIZE 件ずつのチャンクを WP_CONCURRENCY 並列で送信する。
+    成功した更新は meta_hashes に送信データのハッシュを記録する。
+    """
+    ops = [op for _, _, _, company_ops, _ in pending for op in company_ops]
+    chunks = [ops[i:i + WP_BATCH_SIZE] for i in range(0, len(ops), WP_BATCH_SIZE)]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=WP_CONCURRENCY) as executor:
+        for chunk_results in executor.map(send_chunk, chunks):
+            results.extend(chunk_results)
+
+    # 企業単位で成否を集計（日本語版・英語版とも成功で成功）
+    position = 0
+    for kind, ticker, company_name, company_ops, digest in pending:
+        company_results = results[position:position + len(company_ops)]
+        position += len(company_ops)
+
+        label, stat_key = OP_KINDS[kind]
+        if all(company_results):
+            stats[stat_key] += 1
+            if meta_hashes is not None and digest is not None:
+                meta_hashes[ticker] = digest
+            logger.info(f"\n[{label}]: {company_name} ({ticker})\n   ✅ {label}成功")
+        else:
+            stats['failed'] += 1
+            logger.info(f"\n[{label}]: {company_name} ({ticker})\n   ❌ {label}失敗")
+
+    pending.clear()
 
+
+def update_company(post_id, en_post_id, company_data, existing_slug='', dry_run=False):
+    """既存企業ページ更新の書き込みを作成（日本語版・英語版、dry_run なら内容を表示）
+
+    戻り値: [(path, body, 成功ステータス), ...]（flush_pending_ops でまとめて送信）
+    """
     # Dry Run表示
     if dry_run:
         company_name_ja = company_data.get('company_name_ja', '')
@@ -696,74 +614,141 @@ def update_company(post_id, company_data, existing_slug='', dry_run=False):
         stock_price = company_data.get('currentPrice', 0)
         market_cap = company_data.get('marketCap', 0)
 
-        if pd.notna(market_cap) and market_cap > 0:
+        if market_cap > 0:
             market_cap_million = int(market_cap / 1000000)
         else:
             market_cap_million = 0
 
-        print(f"   📍 日本語版:")
-        print(f"      ID: {post_id}")
-        print(f"      スラッグ: {existing_slug}")
-        print(f"      URL: {WP_SITE_URL}/company/{existing_slug}/")
+        logger.info(f"   📍 日本語版:")
+        logger.info(f"      ID: {post_id}")
+        logger.info(f"      スラッグ: {existing_slug}")
+        logger.info(f"      URL: {WP_SITE_URL}/company/{existing_slug}/")
 
         # 英語版も確認
-        en_post_id = get_translation_by_ticker(code, 'en')
         if en_post_id:
-            print(f"   🌐 英語版:")
-            print(f"      ID: {en_post_id}")
-            print(f"      URL: {WP_SITE_URL}/en/company/{existing_slug}/")
+            logger.info(f"   🌐 英語版:")
+            logger.info(f"      ID: {en_post_id}")
+            logger.info(f"      URL: {WP_SITE_URL}/en/company/{existing_slug}/")
         else:
-            print(f"   ⚠️  英語版: 見つかりません")
-
-        print(f"   企業名（日）: {company_name_ja}")
-        print(f"   企業名（英）: {company_name_en}")
-        print(f"   株価: {stock_price:,.0f}円 (更新)" if pd.notna(stock_price) else "   株価: データなし")
-        print(f"   時価総額: {market_cap_million:,}百万円 (更新)")
-
-        return True
+            logger.info(f"   ⚠️  英語版: 見つかりません")
 
-    # 実際の更新処理
-    # 1. 日本語版を更新
-    success_ja = update_single_post(post_id, company_data, 'ja', dry_run)
-
-    # 2. 英語版を更新
-    en_post_id = get_translation_by_ticker(code, 'en')
-    success_en = True
+        logger.info(f"   企業名（日）: {company_name_ja}")
+        logger.info(f"   企業名（英）: {company_name_en}")
+        logger.info(f"   株価: {stock_price:,.0f}円 (更新)" if stock_price else "   株価: データなし")
+        logger.info(f"   時価総額: {market_cap_million:,}百万円 (更新)")
 
+    # 日本語版・英語版に同じmetaを送信
+    data = build_update_data(company_data)
+    ops = [(f'/wp/v2/company/{post_id}', data, 200)]
     if en_post_id:
-        success_en = update_single_post(en_post_id, company_data, 'en', dry_run)
-
-    return success_ja and success_en
+        ops.append((f'/wp/v2/company/{en_post_id}', data, 200))
+    return ops
 
 # ============================================================
 # WordPress企業下書き化
 # ============================================================
 
 def unpublish_company(post_id, dry_run=False):
-    """企業ページを下書きに変更"""
+    """企業ページを下書きに変更する書き込みを作成（dry_run なら内容を表示）
+
+    戻り値: [(path, body, 成功ステータス)]（flush_pending_ops でまとめて送信）
+    """
     if dry_run:
-        print(f"   既存ID: {post_id}")
-        print(f"   アクション: 下書き化")
-        return True
-    
-    headers = get_auth_headers()
-    url = f"{WP_SITE_URL}/wp-json/wp/v2/company/{post_id}"
-    
-    data = {'status': 'draft'}
+        logger.info(f"   既存ID: {post_id}")
+        logger.info(f"   アクション: 下書き化")
     
+    return [(f'/wp/v2/company/{post_id}', {'status': 'draft'}, 200)]
+
+# ============================================================
+# データ前処理
+# ============================================================
+
+def read_company_csv(filepath):
+    """統合CSVから使用する列だけを読み込み（pyarrowがあればマルチスレッドパーサーを使用）
+
+    3_merge_data が同じ内容で保存したParquet（.csv → .parquet）がCSVより新しければそちらを読む。
+    """
+    required_columns = ['code', 'scrape_date'] + NUMERIC_FIELDS + INT_FIELDS + STR_FIELDS + TREND_FIELDS
+    header = pd.read_csv(filepath, encoding='utf-8-sig', nrows=0).columns
+    usecols = [col for col in header if col in required_columns]
+
+    parquet_path = os.path.splitext(filepath)[0] + '.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(filepath):
+        try:
+            df = pd.read_parquet(parquet_path, columns=usecols)
+            # CSV読み込み時（dtype={'code': str}）と型を揃える（古いParquetで数値型の場合に備える）
+            df['code'] = df['code'].astype(str)
+            return df
+        except Exception as e:
+            # pyarrow未インストール・列構成の変更時はCSVから読み直す
+            pass
+
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        return response.status_code == 200
-    except Exception as e:
-        return False
+        return pd.read_csv(filepath, encoding='utf-8-sig', usecols=usecols, dtype={'code': str}, engine='pyarrow')
+    except ImportError:
+        return pd.read_csv(filepath, encoding='utf-8-sig', usecols=usecols, dtype={'code': str})
+
+def prepare_company_frame(df):
+    """投稿meta用の列の型とNaNを一括で整える（行ごとの pd.isna 判定を不要にする）"""
+    df = df.copy()
+    for col in NUMERIC_FIELDS + INT_FIELDS + STR_FIELDS + TREND_FIELDS:
+        if col not in df.columns:
+            df[col] = None
+    if 'scrape_date' not in df.columns:
+        df['scrape_date'] = None
+
+    # 数値列は numpy 配列で一括置換（NaN・JSONに出せない inf は 0）
+    numeric = df[NUMERIC_FIELDS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    np.nan_to_num(numeric, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    df[NUMERIC_FIELDS] = numeric
+
+    integers = df[INT_FIELDS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    np.nan_to_num(integers, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    df[INT_FIELDS] = integers.astype(np.int64)
+
+    # 時価総額（百万円単位に変換）
+    df['marketCap_m'] = (df['marketCap'].clip(lower=0) / 1000000).astype('int64')
+
+    df[STR_FIELDS] = df[STR_FIELDS].fillna('').astype(str)
+    df[TREND_FIELDS] = df[TREND_FIELDS].fillna('neutral').astype(str)
+    df['scrape_date'] = df['scrape_date'].fillna(datetime.now().strftime('%Y-%m-%d')).astype(str)
+
+    return df
+
+# ============================================================
+# 送信済みデータのハッシュ（変更のない更新を省略）
+# ============================================================
+
+def meta_digest(data, post_id, en_post_id):
+    """送信データと送信先IDから安定したハッシュを作成"""
+    payload = json_dumps({'data': data, 'ids': [post_id, en_post_id]}, sort_keys=True)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def load_meta_hashes():
+    """前回送信分の {証券コード: ハッシュ} を読み込み（なければ空）"""
+    try:
+        with open(META_HASH_CACHE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_meta_hashes(meta_hashes):
+    """送信済みハッシュを保存"""
+    try:
+        os.makedirs(os.path.dirname(META_HASH_CACHE) or '.', exist_ok=True)
+        with open(META_HASH_CACHE, 'w', encoding='utf-8') as f:
+            json.dump(meta_hashes, f)
+    except OSError as e:
+        print(f"   ⚠️  ハッシュキャッシュ保存失敗: {e}")
 
 # ============================================================
 # メイン処理
 # ============================================================
 
-def process_companies(integrated_csv, errors_csv, existing_companies, 
+def process_companies(integrated_csv, errors_csv, existing_ids, existing_slugs,
                      limit=None, skip=0, create_status='publish', 
-                     auto_unpublish=False, dry_run=False, update_only=False):
+                     auto_unpublish=False, dry_run=False, update_only=False,
+                     existing_companies_en=None, force_update=False):
     """条件分岐処理"""
     
     print("\n" + "=" * 60)
@@ -775,17 +760,21 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
     
     # 統合データ読み込み
     print(f"\n📥 統合データ読み込み: {integrated_csv}")
-    df = pd.read_csv(integrated_csv, encoding='utf-8-sig')
-    df['code'] = df['code'].astype(str)
+    df = read_company_csv(integrated_csv)
     print(f"   ✅ 読み込み成功: {len(df)}社")
     
+    # yfinanceデータの有無（株価または時価総額があればOK）はNaN補完前に判定
+    has_yfinance = pd.Series(False, index=df.index)
+    for col in ['currentPrice', 'marketCap']:
+        if col in df.columns:
+            has_yfinance |= df[col].notna()
+    
     # エラーデータ読み込み（存在する場合）
-    error_codes = set()
+    error_codes = frozenset()
     if os.path.exists(errors_csv):
         print(f"\n📥 エラーデータ読み込み: {errors_csv}")
-        df_errors = pd.read_csv(errors_csv, encoding='utf-8-sig')
-        df_errors['code'] = df_errors['code'].astype(str)
-        error_codes = set(df_errors['code'].tolist())
+        df_errors = pd.read_csv(errors_csv, encoding='utf-8-sig', usecols=['code'], dtype={'code': str})
+        error_codes = frozenset(df_errors['code'].to_numpy().tolist())
         print(f"   ✅ エラー企業: {len(error_codes)}社")
     else:
         print(f"\n⚠️  エラーファイルなし: {errors_csv}")
@@ -799,6 +788,9 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         df = df.iloc[:limit]
         print(f"📊 処理対象: {len(df)}社")
     
+    # 投稿meta用の列を一括整形（以降の行処理は dict アクセスのみ）
+    df = prepare_company_frame(df)
+    
     # 統計カウンター
     stats = {
         'created': 0,
@@ -808,6 +800,13 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         'failed': 0
     }
     
+    # Batch API送信待ちの書き込み（新規作成・更新・下書き化）
+    pending = []
+    
+    # 前回送信分のハッシュ（--force-update なら全件送信）
+    meta_hashes = load_meta_hashes()
+    unchanged_count = 0
+    
     print("\n" + "=" * 60)
     if dry_run:
         print("🔍 処理内容プレビュー")
@@ -815,80 +814,94 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         print("🚀 WordPress処理開始")
     print("=" * 60)
     
-    for index, row in df.iterrows():
-        ticker = row['code']
-        company_name = row.get('company_name_ja', ticker)
-        
-        # yfinanceデータの有無（株価または時価総額があればOK）
-        has_yfinance_data = pd.notna(row.get('currentPrice')) or pd.notna(row.get('marketCap'))
-        
-        # WordPress登録済みか
-        is_in_wordpress = ticker in existing_companies
-        
-        # 条件分岐
-        if has_yfinance_data and not is_in_wordpress:
-            # 条件1: 新規作成
-            
-            # update-only モードなら新規作成をスキップ
-            if update_only:
-                stats['skipped'] += 1
-                continue
-            
-            prefix = "[Dry Run] 新規作成予定" if dry_run else "[新規]"
-            print(f"\n{prefix}: {company_name} ({ticker})")
+    # 条件分岐はマスクで一括判定し、各条件に該当する行だけを回す
+    has_yf = has_yfinance.loc[df.index]
+    in_wp = df['code'].isin(frozenset(existing_ids))
+    in_err = df['code'].isin(error_codes)
+    
+    to_create = df[has_yf & ~in_wp]
+    to_update = df[has_yf & in_wp]
+    to_unpublish = df[~has_yf & in_err & in_wp]
+    
+    # 条件3: スルー（静かにスキップ、ログ出力なし）
+    stats['skipped'] += int((~has_yf & in_err & ~in_wp).sum())
+    
+    # 条件1: 新規作成（update-only モードならスキップ）
+    if update_only:
+        stats['skipped'] += len(to_create)
+    else:
+        for row in to_create.to_dict('records'):
+            ticker = row['code']
+            company_name = row.get('company_name_ja') or ticker
             
-            if create_company(row, status=create_status, dry_run=dry_run):
+            if dry_run:
+                logger.info(f"\n[Dry Run] 新規作成予定: {company_name} ({ticker})")
+            ops = create_company(row, status=create_status, dry_run=dry_run)
+            if dry_run:
                 stats['created'] += 1
-                if not dry_run:
-                    print(f"   ✅ 作成成功")
-            else:
-                stats['failed'] += 1
-                if not dry_run:
-                    print(f"   ❌ 作成失敗")
-        
-        elif has_yfinance_data and is_in_wordpress:
-            # 条件2: 更新
-            post_id = existing_companies[ticker]['id']
-            existing_slug = existing_companies[ticker].get('slug', '')
-            prefix = "[Dry Run] 更新予定" if dry_run else "[更新]"
-            print(f"\n{prefix}: {company_name} ({ticker})")
-
-            if update_company(post_id, row, existing_slug=existing_slug, dry_run=dry_run):
-                stats['updated'] += 1
-                if not dry_run:
-                    print(f"   ✅ 更新成功")
             else:
-                stats['failed'] += 1
-                if not dry_run:
-                    print(f"   ❌ 更新失敗")
-        
-        elif ticker in error_codes and not is_in_wordpress:
-            # 条件3: スルー
+                pending.append(('create', ticker, company_name, ops, None))
+    
+    # 条件2: 更新
+    for row in to_update.to_dict('records'):
+        ticker = row['code']
+        company_name = row.get('company_name_ja') or ticker
+        post_id = existing_ids[ticker]
+        existing_slug = existing_slugs.get(ticker, '')
+
+        # 英語版IDを取得（事前取得したインデックスを優先、なければAPI検索）
+        if existing_companies_en is not None:
+            en_post_id = existing_companies_en.get(ticker)
+        else:
+            en_post_id = get_translation_by_ticker(ticker, 'en')
+
+        if dry_run:
+            logger.info(f"\n[Dry Run] 更新予定: {company_name} ({ticker})")
+        ops = update_company(post_id, en_post_id, row, existing_slug=existing_slug, dry_run=dry_run)
+        if dry_run:
+            stats['updated'] += 1
+            continue
+
+        # 日本語版・英語版は同じmeta（前回から内容が変わっていなければ送信しない）
+        digest = meta_digest(ops[0][1], post_id, en_post_id)
+        if not force_update and meta_hashes.get(ticker) == digest:
             stats['skipped'] += 1
-            # 静かにスキップ（ログ出力なし）
+            unchanged_count += 1
+            continue
+
+        # 日本語版・英語版の更新をキューに積み、Batch APIでまとめて送信
+        pending.append(('update', ticker, company_name, ops, digest))
+    
+    # 条件4: 下書き化（オプション）
+    for row in to_unpublish.to_dict('records'):
+        ticker = row['code']
+        company_name = row.get('company_name_ja') or ticker
         
-        elif ticker in error_codes and is_in_wordpress:
-            # 条件4: 下書き化（オプション）
-            if auto_unpublish:
-                post_id = existing_companies[ticker]['id']
-                prefix = "[Dry Run] 下書き化予定" if dry_run else "[下書き]"
-                print(f"\n{prefix}: {company_name} ({ticker})")
-                
-                if unpublish_company(post_id, dry_run=dry_run):
-                    stats['unpublished'] += 1
-                    if not dry_run:
-                        print(f"   ✅ 下書き化成功")
-                else:
-                    stats['failed'] += 1
-                    if not dry_run:
-                        print(f"   ❌ 下書き化失敗")
-            else:
-                stats['skipped'] += 1
-                print(f"\n[スキップ] {company_name} ({ticker}) - yfinanceエラー（手動確認推奨）")
+        if not auto_unpublish:
+            stats['skipped'] += 1
+            logger.info(f"\n[スキップ] {company_name} ({ticker}) - yfinanceエラー（手動確認推奨）")
+            continue
         
-        # 待機（Dry Runでは待機しない）
-        if not dry_run:
-            time.sleep(REQUEST_DELAY)
+        post_id = existing_ids[ticker]
+        if dry_run:
+            logger.info(f"\n[Dry Run] 下書き化予定: {company_name} ({ticker})")
+        ops = unpublish_company(post_id, dry_run=dry_run)
+        if dry_run:
+            stats['unpublished'] += 1
+        else:
+            pending.append(('unpublish', ticker, company_name, ops, None))
+    
+    # 新規作成・更新・下書き化をまとめてBatch APIで送信
+    if pending:
+        flush_pending_ops(pending, stats, meta_hashes)
+    
+    if not dry_run:
+        save_meta_hashes(meta_hashes)
+        if unchanged_count:
+            logger.info(f"\n📦 変更なしで送信省略: {unchanged_count}社")
+    
+    # バッファ済みの行ログを出力してから結果表示
+    log_handler.flush()
     
     # 結果表示
     print("\n" + "=" * 60)
@@ -965,8 +978,23 @@ def main():
         help='既存企業のみ更新 (新規作成はスキップ)'
     )
     
+    parser.add_argument(
+        '--force-update',
+        action='store_true',
+        help='前回と内容が同じ企業も更新を送信'
+    )
+    
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='企業ごとの進捗ログを出力しない（警告と集計のみ）'
+    )
+    
     args = parser.parse_args()
     
+    if args.quiet:
+        logger.setLevel(logging.WARNING)
+    
     print("=" * 60)
     print("🚀 WordPress企業データ スマート更新")
     if args.dry_run:
@@ -983,6 +1011,7 @@ def main():
         print(f"スキップ: {args.skip}社")
     print(f"新規作成ステータス: {args.status}")
     print(f"自動下書き化: {'有効' if args.auto_unpublish else '無効'}")
+    print(f"並列数: {WP_CONCURRENCY}（レート上限: {WP_RATE_PER_SEC:g}リクエスト/秒 × バッチ{WP_BATCH_SIZE}件）")
     if args.update_only:
         print(f"既存のみ更新: 有効")
     if args.dry_run:
@@ -990,19 +1019,25 @@ def main():
     print()
     
     # 既存企業取得
-    existing_companies = get_all_existing_companies(WP_URL)
+    existing_ids, existing_slugs = get_all_existing_companies(WP_URL)
+
+    # 英語版インデックス取得（企業ごとの翻訳検索を不要にする）
+    existing_companies_en = load_translation_index('en')
     
     # 処理実行
     stats = process_companies(
         integrated_csv=args.csv,
         errors_csv=args.errors,
-        existing_companies=existing_companies,
+        existing_ids=existing_ids,
+        existing_slugs=existing_slugs,
         limit=args.limit,
         skip=args.skip,
         create_status=args.status,
         auto_unpublish=args.auto_unpublish,
         dry_run=args.dry_run,
-        update_only=args.update_only
+        update_only=args.update_only,
+        existing_companies_en=existing_companies_en,
+        force_update=args.force_update
     )
     
     print("\n✅ スクリプト実行完了")
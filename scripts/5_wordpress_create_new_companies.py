@@ -11,11 +11,19 @@ WordPress企業データ スマート更新スクリプト
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
 import base64
+import json
+import threading
 import time
 import os
 import argparse
 from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ============================================================
 # 設定
@@ -34,30 +42,182 @@ if not WP_USER or not WP_PASSWORD:
 DEFAULT_CSV = 'data/integrated_company_data.csv'
 DEFAULT_ERRORS_CSV = 'output/yfinance_errors_latest.csv'
 
-# 処理速度（秒）
-REQUEST_DELAY = float(os.getenv('REQUEST_DELAY', '0.5'))
+# 並列数・レート上限（全スレッド合計の毎秒リクエスト数）
+WP_CONCURRENCY = int(os.getenv('WP_CONCURRENCY', '8'))
+WP_RATE_PER_SEC = float(os.getenv('WP_RATE_PER_SEC', '8'))
+# サーバーの混雑通知（429 / Retry-After / X-RateLimit-Remaining）への対応
+RATE_LIMIT_BACKOFF = 5.0        # Retry-After が秒数でない場合の待機秒数
+RATE_LIMIT_MIN_REMAINING = 5    # 残りリクエスト数がこれ未満なら1秒分待機
+RATE_LIMIT_RETRIES = 2          # 429 で拒否されたPOSTの再送回数
+
+class RateLimiter:
+    """全スレッド共通のトークンバケット（time.sleep で1件ずつ待つ代わり）"""
+
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.per / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """サーバーから待機を指示されたら、全スレッドの送信をまとめて止める"""
+        with self._lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def observe(self, response):
+        """Retry-After / X-RateLimit-Remaining を見て、必要なときだけ待機を入れる"""
+        retry_after = response.headers.get('Retry-After')
+        if response.status_code == 429 or retry_after:
+            # 秒数以外（HTTP日付など）の場合は既定の待機時間
+            self.pause(float(retry_after) if retry_after and retry_after.isdigit() else RATE_LIMIT_BACKOFF)
+            return
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining and remaining.isdigit() and int(remaining) < RATE_LIMIT_MIN_REMAINING:
+            self.pause(self.per)
+
+
+rate_limiter = RateLimiter(WP_RATE_PER_SEC)
 
 # ============================================================
 # WordPress認証
 # ============================================================
 
-def get_auth_headers():
-    """WordPress REST API認証ヘッダー"""
-    credentials = f"{WP_USER}:{WP_PASSWORD}"
-    token = base64.b64encode(credentials.encode()).decode('utf-8')
-    return {
-        'Authorization': f'Basic {token}',
-        'Content-Type': 'application/json'
-    }
+# 認証ヘッダーは起動時に1回だけ生成
+_AUTH_HEADERS = {
+    'Authorization': 'Basic ' + base64.b64encode(f"{WP_USER}:{WP_PASSWORD}".encode()).decode('utf-8'),
+    'Content-Type': 'application/json'
+}
+
+# ============================================================
+# HTTPセッション（スレッド間でKeep-Alive接続を共有）
+# ============================================================
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    # 429/5xx はバックオフしつつ再試行（最終的な応答はそのまま返す）
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+))
+# 認証ヘッダーはセッションに1回だけ設定（呼び出しごとに渡さない）
+SESSION.headers.update(_AUTH_HEADERS)
+atexit.register(SESSION.close)
+
+# GET・POSTともHTTP/2で1接続に多重化（httpx[http2]がなければSESSIONを使用）
+# httpx には SESSION の Retry が効かないため、接続失敗はトランスポートで再試行し、
+# GET の 429/5xx は wp_get でバックオフしつつ再試行する
+WP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+WP_RETRY_BACKOFF = 0.3          # SESSION の Retry と同じ backoff_factor
+try:
+    import httpx
+    import h2  # noqa: F401  http2=True に必要
+    WP_CLIENT = httpx.Client(
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=3,
+            limits=httpx.Limits(max_connections=WP_CONCURRENCY)
+        ),
+        headers=_AUTH_HEADERS,
+        timeout=30
+    )
+    atexit.register(WP_CLIENT.close)
+    WP_BODY_KWARG = 'content'   # httpx はバイト列本文を content= で受け取る
+    WP_GET_RETRIES = 3
+except ImportError:
+    WP_CLIENT = SESSION
+    WP_BODY_KWARG = 'data'
+    WP_GET_RETRIES = 0          # SESSION は HTTPAdapter の Retry で再試行済み
+
+# JSONのエンコードはorjsonがあれば高速に処理（numpyのスカラーもそのまま扱える）
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+def wp_post(url, json=None, **kwargs):
+    """レート制限付きでWordPressへPOST（日本語版・英語版・WPMLリンクを1件ずつ数える）
+
+    JSON本文は json_dumps で事前にバイト列化して送る（Content-Type はセッションで設定済み）
+    """
+    if json is not None:
+        kwargs[WP_BODY_KWARG] = json_dumps(json)
+
+    # 待機はサーバーが混雑を通知したときだけ（429 は未処理なので待ってから再送）
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire()
+        response = WP_CLIENT.post(url, **kwargs)
+        rate_limiter.observe(response)
+        if response.status_code != 429:
+            break
+    return response
+
+def wp_get(url, **kwargs):
+    """WordPressへGET（429/5xx・通信エラーはバックオフしつつ再試行し、最終的な応答を返す）"""
+    for attempt in range(WP_GET_RETRIES + 1):
+        last_attempt = attempt == WP_GET_RETRIES
+        try:
+            response = WP_CLIENT.get(url, **kwargs)
+        except Exception:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in WP_RETRY_STATUSES or last_attempt:
+                return response
+        time.sleep(WP_RETRY_BACKOFF * (2 ** attempt))
+
+# ============================================================
+# ログ（並列タスクの出力は企業ごとにバッファ）
+# ============================================================
+
+_task_output = threading.local()
+
+def task_log(message):
+    """並列タスク内ではスレッドごとのバッファに溜め、それ以外はそのまま出力
+
+    並列実行中に複数企業の行が混ざらないよう、バッファは完了時に
+    企業名の見出しと一緒にまとめて出力する（run_task 参照）。
+    """
+    lines = getattr(_task_output, 'lines', None)
+    if lines is None:
+        print(message)
+    else:
+        lines.append(message)
 
 # ============================================================
 # WordPress企業取得
 # ============================================================
 
 def get_all_existing_companies(wp_url):
-    """WordPressから既存の全企業を取得（offsetベース）"""
-    headers = get_auth_headers()
-    existing_companies = {}
+    """WordPressから既存の全企業を取得（offsetベース）
+
+    戻り値: (証券コード→投稿ID, 証券コード→スラッグ) の2つのdict
+    """
+    existing_ids = {}
+    existing_slugs = {}
     offset = 0
     per_page = 100
     
@@ -67,13 +227,12 @@ def get_all_existing_companies(wp_url):
         params = {
             'per_page': per_page,
             'offset': offset,
-            'context': 'edit'
+            '_fields': 'id,slug,stock_code'
         }
         
-        response = requests.get(
+        response = wp_get(
             f"{wp_url}/wp-json/wp/v2/company", 
             params=params,
-            headers=headers,
             timeout=30
         )
         
@@ -88,7 +247,7 @@ def get_all_existing_companies(wp_url):
             break
         
         # デバッグ: 最初の1社だけ
-        if offset == 0 and len(existing_companies) == 0:
+        if offset == 0 and len(existing_ids) == 0:
             print(f"\n   🔍 デバッグ（最初の1社）:")
             print(f"      ID: {companies[0].get('id')}")
             print(f"      stock_code: '{companies[0].get('stock_code', '')}'")
@@ -100,12 +259,10 @@ def get_all_existing_companies(wp_url):
             if code:
                 # .T を除去
                 clean_code = str(code).replace('.T', '')
-                existing_companies[clean_code] = {
-                    'id': company['id'],
-                    'slug': company.get('slug', '')
-                }
+                existing_ids[clean_code] = company['id']
+                existing_slugs[clean_code] = company.get('slug', '')
 
-        print(f"   取得済み: {len(existing_companies)}社（このバッチ: {len(companies)}社, offset: {offset}）")
+        print(f"   取得済み: {len(existing_ids)}社（このバッチ: {len(companies)}社, offset: {offset}）")
         
         # 100未満で終了
         if len(companies) < per_page:
@@ -118,21 +275,23 @@ def get_all_existing_companies(wp_url):
             print(f"   ⚠️  安全装置: 5,000社で停止")
             break
     
-    print(f"   ✅ 既存企業取得完了: {len(existing_companies)}社\n")
+    print(f"   ✅ 既存企業取得完了: {len(existing_ids)}社\n")
 
     # デバッグ: 最初の10社を表示
-    if existing_companies:
+    if existing_ids:
         print("   🔍 デバッグ: 既存企業の最初の10社:")
-        for i, (code, info) in enumerate(list(existing_companies.items())[:10]):
-            print(f"      {code}: ID={info['id']}, slug={info['slug']}")
+        for code, post_id in list(existing_ids.items())[:10]:
+            print(f"      {code}: ID={post_id}, slug={existing_slugs[code]}")
         print()
 
-    return existing_companies
+    return existing_ids, existing_slugs
 
 
 def get_all_existing_companies_en(wp_url):
-    """WordPressから既存の全英語版企業を取得（offsetベース）"""
-    headers = get_auth_headers()
+    """WordPressから既存の全英語版企業を取得（offsetベース）
+
+    戻り値: 証券コード→英語版投稿ID のdict
+    """
     existing_companies_en = {}
     offset = 0
     per_page = 100
@@ -143,14 +302,13 @@ def get_all_existing_companies_en(wp_url):
         params = {
             'per_page': per_page,
             'offset': offset,
-            'context': 'edit',
+            '_fields': 'id,slug,stock_code',
             'lang': 'en'
         }
 
-        response = requests.get(
+        response = wp_get(
             f"{wp_url}/wp-json/wp/v2/company",
             params=params,
-            headers=headers,
             timeout=30
         )
 
@@ -170,10 +328,7 @@ def get_all_existing_companies_en(wp_url):
             if code:
                 # .T を除去
                 clean_code = str(code).replace('.T', '')
-                existing_companies_en[clean_code] = {
-                    'id': company['id'],
-                    'slug': company.get('slug', '')
-                }
+                existing_companies_en[clean_code] = company['id']
 
         print(f"   取得済み: {len(existing_companies_en)}社（このバッチ: {len(companies)}社, offset: {offset}）")
 
@@ -193,17 +348,19 @@ def get_all_existing_companies_en(wp_url):
     return existing_companies_en
 
 
+@lru_cache(maxsize=None)
 def get_translation_by_ticker(ticker, target_lang='en'):
-    """証券コードから翻訳投稿を検索"""
+    """証券コードから翻訳投稿を検索（同じ企業は1回だけ問い合わせ）"""
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company"
     params = {
         'lang': target_lang,
         'stock_code': ticker,
-        'per_page': 100
+        'per_page': 100,
+        '_fields': 'id,stock_code'
     }
     
     try:
-        response = requests.get(url, params=params, headers=get_auth_headers())
+        response = wp_get(url, params=params, timeout=30)
         if response.status_code != 200:
             return None
             
@@ -224,123 +381,57 @@ def get_translation_by_ticker(ticker, target_lang='en'):
 
 
 # ============================================================
-# WPML翻訳リンク
+# 投稿データの前処理
 # ============================================================
 
-def link_wpml_via_official_api(ja_post_id, en_post_id):
-    """WPML正式APIで翻訳リンクを設定"""
-    try:
-        url = f"{WP_SITE_URL}/wp-json/custom/v1/wpml-link"
-        
-        payload = {
-            "ja_post_id": ja_post_id,
-            "en_post_id": en_post_id,
-            "post_type": "company",
-        }
-        
-        response = requests.post(
-            url,
-            headers=get_auth_headers(),
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("success"):
-                print(f"   ✅ WPML リンク成功")
-                return True
-            else:
-                print(f"   ❌ WPML リンク失敗: {result.get('message', '不明')}")
-                return False
-        else:
-            print(f"   ❌ WPML API エラー: {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"   ❌ WPML リンク例外: {str(e)}")
-        return False
-
-
-def create_english_post(ja_post_id, company_data, status='publish', dry_run=False):
-    """英語投稿を作成"""
-    code = company_data.get('code', '')
-    
-    if dry_run:
-        company_name_en = company_data.get('short_name_en', '')
-        if pd.isna(company_name_en):
-            company_name_en = company_data.get('company_name_en', '')
-        print(f"   🌐 英語版作成予定:")
-        print(f"      URL: {WP_SITE_URL}/en/company/company-{code}/")
-        print(f"      企業名（英）: {company_name_en}")
-        return True
-    
-    headers = get_auth_headers()
-    url = f"{WP_SITE_URL}/wp-json/wp/v2/company?lang=en"
-    
-    # 時価総額変換
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-    
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-    
-    # 企業名（英語）
-    company_name_en = company_data.get('short_name_en', '')
-    if pd.isna(company_name_en):
-        company_name_en = company_data.get('company_name_en', '')
-    if pd.isna(company_name_en):
-        company_name_en = ''
+# 文字列として扱う列（NaN は空文字にする）
+TEXT_COLUMNS = ['sector', 'industry', 'company_name_ja', 'company_name_en', 'short_name_en']
+
+# 投稿metaのキーと、前処理済みの行の列名の対応（日本語版の作成・更新で共通）
+META_COLUMNS = [
+    ('marketCap', 'marketCap_million'),
+    ('regularMarketPrice', 'currentPrice'),
+    ('DATE', 'scrape_date'),
+    ('company_name_ja', 'company_name_ja'),
+    ('longName', 'company_name_en'),
+    ('sector', 'sector'),
+    ('industry', 'industry'),
+]
+META_KEYS = tuple(key for key, _ in META_COLUMNS)
+get_meta_values = itemgetter(*(column for _, column in META_COLUMNS))
+
+def read_company_csv(filepath):
+    """統合CSVから使用する列だけを読み込み（他の列はパースせずメモリにも載せない）"""
+    required_columns = {'code', 'currentPrice', 'marketCap', 'scrape_date', *TEXT_COLUMNS}
+    header = pd.read_csv(filepath, encoding='utf-8-sig', nrows=0).columns
+    usecols = [col for col in header if col in required_columns]
+    return pd.read_csv(filepath, encoding='utf-8-sig', usecols=usecols, dtype={'code': str})
+
+
+def prepare_company_frame(df):
+    """NaN処理・単位変換を列単位で一括実行（行ごとの pd.isna 判定を不要にする）"""
+    df = df.copy()
+    
+    # 時価総額（百万円単位）・株価
+    market_cap = df['marketCap'] if 'marketCap' in df.columns else pd.Series(0, index=df.index)
+    df['marketCap_million'] = (market_cap.fillna(0).clip(lower=0) / 1_000_000).astype('int64')
+    price = df['currentPrice'] if 'currentPrice' in df.columns else pd.Series(0, index=df.index)
+    df['currentPrice'] = price.fillna(0).astype('float64')
+    
+    # 企業名・セクター・業種
+    for col in TEXT_COLUMNS:
+        df[col] = df[col].fillna('').astype(str) if col in df.columns else ''
     
     # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
+    today = datetime.now().strftime('%Y-%m-%d')
+    df['scrape_date'] = df['scrape_date'].fillna(today).astype(str) if 'scrape_date' in df.columns else today
     
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-    
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    
-    # 投稿データ
-    data = {
-        'title': str(company_name_en) if company_name_en else f"Company {code}",
-        'slug': f'company-{code}',
-        'status': status,
-        'meta': {
-            'Ticker': str(code),
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
-        }
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-        if response.status_code == 201:
-            result = response.json()
-            en_post_id = result.get('id')
-            print(f"   🌐 英語版作成成功 (ID: {en_post_id})")
-            return en_post_id
-        else:
-            print(f"   ❌ 英語版作成失敗: {response.status_code}")
-            print(f"   レスポンス: {response.text[:200]}")
-            return None
-    except Exception as e:
-        print(f"   ❌ 英語版作成例外: {str(e)}")
-        return None
+    return df
+
+
+def build_company_meta(company_data):
+    """日本語版の作成・更新で共通の meta（前処理済みの行から作成）"""
+    return dict(zip(META_KEYS, get_meta_values(company_data)))
 
 
 # ============================================================
@@ -358,9 +449,8 @@ def link_wpml_via_official_api(ja_post_id, en_post_id):
             "post_type": "company",
         }
         
-        response = requests.post(
+        response = wp_post(
             url,
-            headers=get_auth_headers(),
             json=payload,
             timeout=30
         )
@@ -368,16 +458,16 @@ def link_wpml_via_official_api(ja_post_id, en_post_id):
         if response.status_code == 200:
             result = response.json()
             if result.get("success"):
-                print(f"   ✅ WPML リンク成功")
+                task_log(f"   ✅ WPML リンク成功")
                 return True
             else:
-                print(f"   ❌ WPML リンク失敗: {result.get('message', '不明')}")
+                task_log(f"   ❌ WPML リンク失敗: {result.get('message', '不明')}")
                 return False
         else:
-            print(f"   ❌ WPML API エラー: {response.status_code}")
+            task_log(f"   ❌ WPML API エラー: {response.status_code}")
             return False
     except Exception as e:
-        print(f"   ❌ WPML リンク例外: {str(e)}")
+        task_log(f"   ❌ WPML リンク例外: {str(e)}")
         return False
 
 
@@ -385,81 +475,46 @@ def create_english_post(ja_post_id, company_data, status='publish', dry_run=Fals
     """英語投稿を作成"""
     code = company_data.get('code', '')
     
+    # 企業名（英語）: 短縮名を優先
+    company_name_en = company_data['short_name_en'] or company_data['company_name_en']
+    
     if dry_run:
-        company_name_en = company_data.get('short_name_en', '')
-        if pd.isna(company_name_en):
-            company_name_en = company_data.get('company_name_en', '')
         print(f"   🌐 英語版作成予定:")
         print(f"      URL: {WP_SITE_URL}/en/company/company-{code}/")
         print(f"      企業名（英）: {company_name_en}")
         return True
     
-    headers = get_auth_headers()
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company?lang=en"
     
-    # 時価総額変換
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-    
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-    
-    # 企業名（英語）
-    company_name_en = company_data.get('short_name_en', '')
-    if pd.isna(company_name_en):
-        company_name_en = company_data.get('company_name_en', '')
-    if pd.isna(company_name_en):
-        company_name_en = ''
-    
-    # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
-    
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-    
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    
     # 投稿データ
     data = {
-        'title': str(company_name_en) if company_name_en else f"Company {code}",
+        'title': company_name_en or f"Company {code}",
         'slug': f'company-{code}',
         'status': status,
         'meta': {
             'Ticker': str(code),
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
+            'marketCap': int(company_data['marketCap_million']),
+            'regularMarketPrice': float(company_data['currentPrice']),
+            'DATE': company_data['scrape_date'],
+            'longName': company_name_en,
+            'sector': company_data['sector'],
+            'industry': company_data['industry'],
         }
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = wp_post(url, json=data, timeout=30)
         if response.status_code == 201:
             result = response.json()
             en_post_id = result.get('id')
-            print(f"   🌐 英語版作成成功 (ID: {en_post_id})")
+            task_log(f"   🌐 英語版作成成功 (ID: {en_post_id})")
             return en_post_id
         else:
-            print(f"   ❌ 英語版作成失敗: {response.status_code}")
-            print(f"   レスポンス: {response.text[:200]}")
+            task_log(f"   ❌ 英語版作成失敗: {response.status_code}")
+            task_log(f"   レスポンス: {response.text[:200]}")
             return None
     except Exception as e:
-        print(f"   ❌ 英語版作成例外: {str(e)}")
+        task_log(f"   ❌ 英語版作成例外: {str(e)}")
         return None
 
 def create_company(company_data, status='publish', dry_run=False):
@@ -468,90 +523,37 @@ def create_company(company_data, status='publish', dry_run=False):
     
     # Dry Run表示
     if dry_run:
-        company_name_ja = company_data.get('company_name_ja', '')
-        company_name_en = company_data.get('short_name_en', '')
-        if pd.isna(company_name_en) or company_name_en == '':
-            company_name_en = company_data.get('company_name_en', '')
-        stock_price = company_data.get('currentPrice', 0)
-        market_cap = company_data.get('marketCap', 0)
-        
-        if pd.notna(market_cap) and market_cap > 0:
-            market_cap_million = int(market_cap / 1000000)
-        else:
-            market_cap_million = 0
-        
+        stock_price = company_data['currentPrice']
         print(f"   スラッグ: company-{code}")
         print(f"   URL: {WP_SITE_URL}/company/company-{code}/")
-        print(f"   企業名（日）: {company_name_ja}")
-        print(f"   企業名（英）: {company_name_en}")
-        print(f"   株価: {stock_price:,.0f}円" if pd.notna(stock_price) else "   株価: データなし")
-        print(f"   時価総額: {market_cap_million:,}百万円")
+        print(f"   企業名（日）: {company_data['company_name_ja']}")
+        print(f"   企業名（英）: {company_data['short_name_en'] or company_data['company_name_en']}")
+        print(f"   株価: {stock_price:,.0f}円" if stock_price else "   株価: データなし")
+        print(f"   時価総額: {company_data['marketCap_million']:,}百万円")
         print(f"   ステータス: {status}")
         return True
     
     # 実際の作成処理
-    headers = get_auth_headers()
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company"
     
-    # 時価総額（百万円単位に変換）
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-    
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-    
-    # 企業名
-    company_name_ja = company_data.get('company_name_ja', '')
-    company_name_en = company_data.get('company_name_en', '')
-    
-    # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
-    
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-    
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    if pd.isna(company_name_ja):
-        company_name_ja = ''
-    if pd.isna(company_name_en):
-        company_name_en = ''
-    
     # 投稿データ
     data = {
-        'title': str(company_name_ja),
+        'title': company_data['company_name_ja'],
         'slug': f'company-{code}',
         'status': status,
         'meta': {
             'Ticker': str(code),
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'company_name_ja': str(company_name_ja),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
+            **build_company_meta(company_data),
             'ir_tier': 'basic',
         }
     }
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = wp_post(url, json=data, timeout=30)
         if response.status_code == 201:
             result = response.json()
             ja_post_id = result.get("id")
-            print(f"   📍 日本語版作成成功 (ID: {ja_post_id})")
+            task_log(f"   📍 日本語版作成成功 (ID: {ja_post_id})")
             
             # 英語版も作成
             en_post_id = create_english_post(ja_post_id, company_data, status, dry_run=False)
@@ -561,13 +563,13 @@ def create_company(company_data, status='publish', dry_run=False):
             
             return True
         else:
-            print(f"   HTTPエラー: {response.status_code}")
-            print(f"   レスポンス: {response.text[:500]}")
+            task_log(f"   HTTPエラー: {response.status_code}")
+            task_log(f"   レスポンス: {response.text[:500]}")
             return False
     except Exception as e:
-        print(f"   エラー詳細: {str(e)}")
+        task_log(f"   エラー詳細: {str(e)}")
         import traceback
-        traceback.print_exc()
+        task_log(traceback.format_exc().rstrip())
         return False
 # ============================================================
 # WordPress企業更新
@@ -575,59 +577,13 @@ def create_company(company_data, status='publish', dry_run=False):
 
 def update_single_post(post_id, company_data, lang='ja', dry_run=False):
     """単一投稿を更新（言語指定可能）"""
-    headers = get_auth_headers()
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company/{post_id}"
     
-    # 時価総額（百万円単位に変換）
-    market_cap = company_data.get('marketCap', 0)
-    if pd.notna(market_cap) and market_cap > 0:
-        market_cap_million = int(market_cap / 1000000)
-    else:
-        market_cap_million = 0
-    
-    # 株価
-    stock_price = company_data.get('currentPrice', 0)
-    if pd.isna(stock_price):
-        stock_price = 0
-    else:
-        stock_price = float(stock_price)
-    
-    # 企業名
-    company_name_ja = company_data.get('company_name_ja', '')
-    company_name_en = company_data.get('company_name_en', '')
-    
-    # 日付
-    date = company_data.get('scrape_date', datetime.now().strftime('%Y-%m-%d'))
-    
-    # セクター・業種
-    sector = company_data.get('sector', '')
-    industry = company_data.get('industry', '')
-    
-    # NaN対策
-    if pd.isna(sector):
-        sector = ''
-    if pd.isna(industry):
-        industry = ''
-    if pd.isna(company_name_ja):
-        company_name_ja = ''
-    if pd.isna(company_name_en):
-        company_name_en = ''
-    
     # 更新データ
-    data = {
-        'meta': {
-            'marketCap': market_cap_million,
-            'regularMarketPrice': stock_price,
-            'DATE': str(date),
-            'company_name_ja': str(company_name_ja),
-            'longName': str(company_name_en),
-            'sector': str(sector),
-            'industry': str(industry),
-        }
-    }
+    data = {'meta': build_company_meta(company_data)}
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = wp_post(url, json=data, timeout=30)
         return response.status_code == 200
     except Exception as e:
         print(f"   エラー詳細: {str(e)}")
@@ -640,25 +596,17 @@ def update_company(post_id, company_data, existing_slug='', dry_run=False, exist
     """既存企業ページ更新（多言語対応）"""
     code = company_data.get('code', '')
 
-    # 英語版IDを取得（事前取得したマッピングを優先、なければAPI検索）
-    en_post_id = None
-    if existing_companies_en and code in existing_companies_en:
-        en_post_id = existing_companies_en[code]['id']
+    # 英語版IDを取得（事前取得したマッピングがあればそれだけを参照、なければAPI検索）
+    # マッピングにない企業は英語版なしとみなし、企業ごとのAPI検索はしない
+    if existing_companies_en is not None:
+        en_post_id = existing_companies_en.get(code)
     else:
         # フォールバック: 従来のAPI検索
         en_post_id = get_translation_by_ticker(code, 'en')
 
     # Dry Run表示
     if dry_run:
-        company_name_ja = company_data.get('company_name_ja', '')
-        company_name_en = company_data.get('company_name_en', '')
-        stock_price = company_data.get('currentPrice', 0)
-        market_cap = company_data.get('marketCap', 0)
-
-        if pd.notna(market_cap) and market_cap > 0:
-            market_cap_million = int(market_cap / 1000000)
-        else:
-            market_cap_million = 0
+        stock_price = company_data['currentPrice']
 
         print(f"   📍 日本語版:")
         print(f"      ID: {post_id}")
@@ -673,10 +621,10 @@ def update_company(post_id, company_data, existing_slug='', dry_run=False, exist
         else:
             print(f"   ⚠️  英語版: 見つかりません")
 
-        print(f"   企業名（日）: {company_name_ja}")
-        print(f"   企業名（英）: {company_name_en}")
-        print(f"   株価: {stock_price:,.0f}円 (更新)" if pd.notna(stock_price) else "   株価: データなし")
-        print(f"   時価総額: {market_cap_million:,}百万円 (更新)")
+        print(f"   企業名（日）: {company_data['company_name_ja']}")
+        print(f"   企業名（英）: {company_data['company_name_en']}")
+        print(f"   株価: {stock_price:,.0f}円 (更新)" if stock_price else "   株価: データなし")
+        print(f"   時価総額: {company_data['marketCap_million']:,}百万円 (更新)")
 
         return True
 
@@ -703,25 +651,49 @@ def unpublish_company(post_id, dry_run=False):
         print(f"   アクション: 下書き化")
         return True
     
-    headers = get_auth_headers()
     url = f"{WP_SITE_URL}/wp-json/wp/v2/company/{post_id}"
     
     data = {'status': 'draft'}
     
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = wp_post(url, json=data, timeout=30)
         return response.status_code == 200
     except Exception as e:
-        print(f"   エラー詳細: {str(e)}")
+        task_log(f"   エラー詳細: {str(e)}")
         import traceback
-        traceback.print_exc()
+        task_log(traceback.format_exc().rstrip())
         return False
 
 # ============================================================
 # メイン処理
 # ============================================================
 
-def process_companies(integrated_csv, errors_csv, existing_companies,
+# 並列タスクの表示名と集計キー
+TASK_LABELS = {
+    'create': ('新規作成', 'created'),
+    'unpublish': ('下書き化', 'unpublished'),
+}
+
+def run_task(kind, row, post_id, create_status):
+    """並列処理用のラッパー関数（新規作成・下書き化）
+
+    戻り値: (成否, タスク中に task_log で出力した行のリスト)
+    """
+    _task_output.lines = lines = []
+    try:
+        if kind == 'create':
+            success = create_company(row, status=create_status)
+        else:
+            success = unpublish_company(post_id)
+    except Exception as e:
+        lines.append(f"   ❌ 例外: {str(e)}")
+        success = False
+    finally:
+        # スレッドは再利用されるので、バッファを外して直接出力に戻す
+        _task_output.lines = None
+    return success, lines
+
+def process_companies(integrated_csv, errors_csv, existing_ids, existing_slugs,
                      limit=None, skip=0, create_status='publish',
                      auto_unpublish=False, dry_run=False, update_only=False,
                      existing_companies_en=None):
@@ -736,17 +708,16 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
     
     # 統合データ読み込み
     print(f"\n📥 統合データ読み込み: {integrated_csv}")
-    df = pd.read_csv(integrated_csv, encoding='utf-8-sig')
-    df['code'] = df['code'].astype(str)
+    df = read_company_csv(integrated_csv)
     print(f"   ✅ 読み込み成功: {len(df)}社")
     
     # エラーデータ読み込み（存在する場合）
     error_codes = set()
     if os.path.exists(errors_csv):
         print(f"\n📥 エラーデータ読み込み: {errors_csv}")
-        df_errors = pd.read_csv(errors_csv, encoding='utf-8-sig')
-        df_errors['code'] = df_errors['code'].astype(str)
-        error_codes = set(df_errors['code'].tolist())
+        # 使うのは code 列だけなので他の列はパースしない
+        df_errors = pd.read_csv(errors_csv, encoding='utf-8-sig', usecols=['code'], dtype={'code': str})
+        error_codes = set(df_errors['code'])
         print(f"   ✅ エラー企業: {len(error_codes)}社")
     else:
         print(f"\n⚠️  エラーファイルなし: {errors_csv}")
@@ -760,6 +731,17 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         df = df.iloc[:limit]
         print(f"📊 処理対象: {len(df)}社")
     
+    # yfinanceデータの有無（NaN埋め前に列単位で判定）
+    # 英語名があり、かつ株価または時価総額がある
+    has_name = df.get('company_name_en', pd.Series(index=df.index, dtype=object)).notna() | \
+        df.get('short_name_en', pd.Series(index=df.index, dtype=object)).notna()
+    has_price = df.get('currentPrice', pd.Series(index=df.index, dtype=float)).fillna(0) > 0
+    has_market_cap = df.get('marketCap', pd.Series(index=df.index, dtype=float)).fillna(0) > 0
+    has_yfinance = has_name & (has_price | has_market_cap)
+    
+    # NaN処理・単位変換を一括実行
+    df = prepare_company_frame(df)
+    
     # 統計カウンター
     stats = {
         'created': 0,
@@ -768,6 +750,10 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         'unpublished': 0,
         'failed': 0
     }
+    stats_lock = threading.Lock()
+    
+    # 並列実行する新規作成・下書き化
+    tasks = []
     
     print("\n" + "=" * 60)
     if dry_run:
@@ -776,85 +762,92 @@ def process_companies(integrated_csv, errors_csv, existing_companies,
         print("🚀 WordPress処理開始")
     print("=" * 60)
     
-    for index, row in df.iterrows():
-        ticker = row['code']
-        company_name = row.get('company_name_ja', ticker)
-        
-        # yfinanceデータの有無
-        # 英語名チェック
-        has_name = pd.notna(row.get('company_name_en')) or pd.notna(row.get('short_name_en'))
-        
-        # 重要な財務データのチェック
-        has_price = pd.notna(row.get('currentPrice')) and row.get('currentPrice') > 0
-        has_market_cap = pd.notna(row.get('marketCap')) and row.get('marketCap') > 0
-        
-        # 英語名があり、かつ株価または時価総額がある
-        has_yfinance_data = has_name and (has_price or has_market_cap)
-        
-        # WordPress登録済みか
-        is_in_wordpress = ticker in existing_companies
-        
-        # 条件分岐
-        if has_yfinance_data and not is_in_wordpress:
-            # 条件1: 新規作成
+    # 条件分岐はマスクで一括判定し、各条件に該当する行だけを回す
+    # （Series を行ごとに生成しないよう dict のリストで回す）
+    in_wp = df['code'].isin(frozenset(existing_ids))
+    in_err = df['code'].isin(error_codes)
+    
+    to_create = df[has_yfinance & ~in_wp]
+    to_skip_existing = df[has_yfinance & in_wp]
+    to_unpublish = df[~has_yfinance & in_err & in_wp]
+    
+    # 条件3: スルー（静かにスキップ、ログ出力なし）
+    stats['skipped'] += int((~has_yfinance & in_err & ~in_wp).sum())
+    
+    # 条件1: 新規作成（update-only モードならスキップ）
+    if update_only:
+        stats['skipped'] += len(to_create)
+    else:
+        for row in to_create.to_dict('records'):
+            ticker = row['code']
+            company_name = row['company_name_ja'] or ticker
             
-            # update-only モードなら新規作成をスキップ
-            if update_only:
-                stats['skipped'] += 1
+            if not dry_run:
+                tasks.append(('create', ticker, company_name, row, None))
                 continue
             
-            prefix = "[Dry Run] 新規作成予定" if dry_run else "[新規]"
-            print(f"\n{prefix}: {company_name} ({ticker})")
-            
+            print(f"\n[Dry Run] 新規作成予定: {company_name} ({ticker})")
             if create_company(row, status=create_status, dry_run=dry_run):
                 stats['created'] += 1
-                if not dry_run:
-                    print(f"   ✅ 作成成功")
             else:
                 stats['failed'] += 1
-                if not dry_run:
-                    print(f"   ❌ 作成失敗")
+    
+    # 条件2: 既存企業はスキップ（更新しない）。英語版リンク状況を表示
+    stats['skipped'] += len(to_skip_existing)
+    for ticker, company_name_ja in zip(to_skip_existing['code'], to_skip_existing['company_name_ja']):
+        company_name = company_name_ja or ticker
+        post_id = existing_ids[ticker]
+        existing_slug = existing_slugs.get(ticker) or ticker
+        en_post_id = existing_companies_en.get(ticker) if existing_companies_en else None
+
+        print(f"\n[スキップ] {company_name} ({ticker})")
+        print(f"   📍 日本語版: ID={post_id}, URL: {WP_SITE_URL}/company/{existing_slug}/")
+        if en_post_id:
+            print(f"   🌐 英語版: ID={en_post_id}, URL: {WP_SITE_URL}/en/company/{existing_slug}/")
+    
+    # 条件4: 下書き化（オプション）
+    for row in to_unpublish.to_dict('records'):
+        ticker = row['code']
+        company_name = row['company_name_ja'] or ticker
         
-        elif has_yfinance_data and is_in_wordpress:
-            # 条件2: 既存企業はスキップ（更新しない）
+        if not auto_unpublish:
             stats['skipped'] += 1
-            # 英語版リンク状況を表示
-            post_id = existing_companies[ticker]['id']
-            existing_slug = existing_companies[ticker].get('slug', ticker)
-            en_info = existing_companies_en.get(ticker) if existing_companies_en else None
-
-            print(f"\n[スキップ] {company_name} ({ticker})")
-            print(f"   📍 日本語版: ID={post_id}, URL: {WP_SITE_URL}/company/{existing_slug}/")
-            if en_info:
-                print(f"   🌐 英語版: ID={en_info['id']}, URL: {WP_SITE_URL}/en/company/{existing_slug}/")
+            print(f"\n[スキップ] {company_name} ({ticker}) - yfinanceエラー（手動確認推奨）")
+            continue
         
-        elif ticker in error_codes and not is_in_wordpress:
-            # 条件3: スルー
-            stats['skipped'] += 1
-            # 静かにスキップ（ログ出力なし）
+        post_id = existing_ids[ticker]
+        if not dry_run:
+            tasks.append(('unpublish', ticker, company_name, row, post_id))
+            continue
         
-        elif ticker in error_codes and is_in_wordpress:
-            # 条件4: 下書き化（オプション）
-            if auto_unpublish:
-                post_id = existing_companies[ticker]['id']
-                prefix = "[Dry Run] 下書き化予定" if dry_run else "[下書き]"
-                print(f"\n{prefix}: {company_name} ({ticker})")
+        print(f"\n[Dry Run] 下書き化予定: {company_name} ({ticker})")
+        if unpublish_company(post_id, dry_run=dry_run):
+            stats['unpublished'] += 1
+        else:
+            stats['failed'] += 1
+    
+    # 新規作成・下書き化を並列実行（送信レートは rate_limiter で全スレッド共通に管理）
+    if tasks:
+        with ThreadPoolExecutor(max_workers=WP_CONCURRENCY) as executor:
+            future_to_task = {
+                executor.submit(run_task, kind, row, post_id, create_status): (kind, ticker, company_name)
+                for kind, ticker, company_name, row, post_id in tasks
+            }
+            
+            for future in as_completed(future_to_task):
+                kind, ticker, company_name = future_to_task[future]
+                success, lines = future.result()
                 
-                if unpublish_company(post_id, dry_run=dry_run):
-                    stats['unpublished'] += 1
-                    if not dry_run:
-                        print(f"   ✅ 下書き化成功")
-                else:
-                    stats['failed'] += 1
-                    if not dry_run:
-                        print(f"   ❌ 下書き化失敗")
-            else:
-                stats['skipped'] += 1
-                print(f"\n[スキップ] {company_name} ({ticker}) - yfinanceエラー（手動確認推奨）")
-        
-        # 待機（Dry Runでは待機しない）
-        if not dry_run:
-            time.sleep(REQUEST_DELAY)
+                label, stat_key = TASK_LABELS[kind]
+                with stats_lock:
+                    if success:
+                        stats[stat_key] += 1
+                    else:
+                        stats['failed'] += 1
+                # 企業ごとの詳細ログは見出しの直後にまとめて出力（他スレッドの行と混ざらない）
+                mark = "✅" if success else "❌"
+                print("\n".join([f"\n[{label}]: {company_name} ({ticker})", *lines,
+                                 f"   {mark} {label}{'成功' if success else '失敗'}"]))
     
     # 結果表示
     print("\n" + "=" * 60)
@@ -956,7 +949,7 @@ def main():
     print()
     
     # 既存企業取得（日本語版）
-    existing_companies = get_all_existing_companies(WP_URL)
+    existing_ids, existing_slugs = get_all_existing_companies(WP_URL)
 
     # 既存企業取得（英語版）- 将来の更新機能用
     existing_companies_en = get_all_existing_companies_en(WP_URL)
@@ -965,7 +958,8 @@ def main():
     stats = process_companies(
         integrated_csv=args.csv,
         errors_csv=args.errors,
-        existing_companies=existing_companies,
+        existing_ids=existing_ids,
+        existing_slugs=existing_slugs,
         limit=args.limit,
         skip=args.skip,
         create_status=args.status,
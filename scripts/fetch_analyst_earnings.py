@@ -12,44 +12,155 @@ yfinanceからアナリスト推奨・目標株価・決算日程・株主構成
 
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import json
 import os
 import sys
 import time
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
 from datetime import datetime
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import queue
+import random
+
+# 進捗表示はtqdmがあれば使用（なければ PROGRESS_INTERVAL ごとに print）
+try:
+    from tqdm.auto import tqdm
+except ImportError:
+    tqdm = None
+
+try:
+    from yfinance.exceptions import YFRateLimitError
+except ImportError:
+    # 古いyfinanceにはレート制限専用の例外がない
+    class YFRateLimitError(Exception):
+        pass
 
 # 設定
 OUTPUT_DIR = "data/analyst_earnings"
-MAX_WORKERS = 3  # 並列数（yfinance API制限対策）
+MAX_WORKERS = 3  # 並列数（yfinance API制限対策、レート制限付きセッションがない場合）
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+RATE_LIMIT_MAX_DELAY = 60  # レート制限エラー時の指数バックオフ上限（秒）
 PROGRESS_INTERVAL = 20
 BATCH_SIZE = 50  # バッチサイズ
 BATCH_DELAY = 45  # バッチ間の待機秒数
+FRESH_HOURS = float(os.getenv('ANALYST_FRESH_HOURS', '20'))  # この時間内に保存したJSONは再取得しない
 
 # WordPress REST API設定
 WP_SITE_URL = os.getenv('WP_SITE_URL', 'https://japanir.jp')
 WP_API_URL = f"{WP_SITE_URL}/wp-json/wp/v2/company"
 REQUEST_TIMEOUT = 30
 MAX_PAGES = 50  # 最大50ページ（5000社）
-
-# スレッドセーフなカウンター
-lock = threading.Lock()
+WP_PAGE_WORKERS = 8  # 企業一覧のページ並列数
+
+# WordPress用の共有セッション（Keep-Aliveで接続を再利用、スレッド間で共有）
+WP_SESSION = requests.Session()
+WP_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    # 429/5xx はバックオフしつつ再試行（最終的な応答はそのまま返す）
+    max_retries=Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+))
+atexit.register(WP_SESSION.close)
+
+# yfinance用のディスクキャッシュ・レート制限（requests_cache / requests_ratelimiter があれば使用）
+YF_CACHE_PATH = os.getenv('YF_CACHE_PATH', 'data/.yf_cache')
+YF_CACHE_TTL = int(os.getenv('YF_CACHE_TTL', '3600'))  # quoteSummary（推奨・目標株価・株主）の保持秒数
+YF_RATE_PER_SEC = float(os.getenv('YF_RATE_PER_SEC', '5'))
+
+# 進捗カウンター（完了結果を受け取るメインスレッドだけが更新するのでロック不要）
 progress_counter = {"success": 0, "error": 0, "total": 0}
 
 
+def build_yf_session():
+    """キャッシュ＋レート制限付きのyfinance用セッションを作成（ライブラリがなければ None）
+
+    同じ日の再実行や失敗後の再実行では quoteSummary をディスクから返し、
+    Cookie・crumb など認証系のURLはキャッシュしない。
+    """
+    try:
+        from requests_cache import CacheMixin, SQLiteCache, DO_NOT_CACHE
+        from requests_ratelimiter import LimiterMixin
+    except ImportError:
+        return None
+
+    class CachedLimiterSession(CacheMixin, LimiterMixin, requests.Session):
+        pass
+
+    session = CachedLimiterSession(
+        per_second=YF_RATE_PER_SEC,
+        backend=SQLiteCache(YF_CACHE_PATH),
+        expire_after=DO_NOT_CACHE,
+        urls_expire_after={'*/quoteSummary/*': YF_CACHE_TTL},
+    )
+
+    # curl_cffi のセッションしか受け付けないyfinanceでは使わない（Ticker作成は通信なし）
+    try:
+        yf.Ticker("7203.T", session=session)
+    except Exception as e:
+        return None
+    return session
+
+
+YF_SESSION = build_yf_session()
+
+# 送信ペースをリミッターに任せられる場合は並列数を増やす（YF_MAX_WORKERS で上書き可）
+if YF_SESSION is not None:
+    MAX_WORKERS = min(32, (os.cpu_count() or 4) * 5)
+MAX_WORKERS = int(os.getenv('YF_MAX_WORKERS', MAX_WORKERS))
+
+
+def create_tickers(symbols):
+    """yf.Tickers を作成（共有セッションを受け付けないyfinanceではセッションなしで作成）"""
+    global YF_SESSION
+    if YF_SESSION is not None:
+        try:
+            return yf.Tickers(symbols, session=YF_SESSION)
+        except Exception as e:
+            print(f"⚠️  キャッシュ付きセッションを使用できません（{e}）: 通常のセッションで続行")
+            YF_SESSION = None
+    return yf.Tickers(symbols)
+
+
+# アナリスト推奨の出力キー → yfinance の列名
+RECOMMENDATION_COLUMNS = {
+    "strong_buy": "strongBuy",
+    "buy": "buy",
+    "hold": "hold",
+    "sell": "sell",
+    "strong_sell": "strongSell",
+}
+
+# 決算日程の出力キー → yfinance の列名
+EARNINGS_COLUMNS = {
+    "eps_estimate": "EPS Estimate",
+    "eps_actual": "Reported EPS",
+    "surprise_pct": "Surprise(%)",
+}
+
+
 class AnalystEarningsFetcher:
     """アナリスト予想・決算日程取得クラス"""
 
-    def __init__(self, ticker_code, verbose=False):
+    def __init__(self, ticker_code, verbose=False, ticker=None):
         self.ticker_code = str(ticker_code).replace('.T', '')
         self.ticker_full = f"{self.ticker_code}.T"
-        self.ticker = yf.Ticker(self.ticker_full)
+        # バッチ単位で作成済みの yf.Ticker があれば再利用
+        if ticker is None:
+            ticker = create_tickers(self.ticker_full).tickers[self.ticker_full.upper()]
+        self.ticker = ticker
         self.info = {}
         self.verbose = verbose
 
@@ -82,7 +193,11 @@ class AnalystEarningsFetcher:
                     print(f"    Attempt {attempt + 1}/{MAX_RETRIES} failed: {error_msg}")
 
                 if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY)
+                    if isinstance(e, YFRateLimitError):
+                        # レート制限のときだけ指数バックオフ＋ジッター（スレッド同士で再送が揃わないように）
+                        time.sleep(min(RATE_LIMIT_MAX_DELAY, RETRY_DELAY * 2 ** attempt) + random.uniform(0, 1))
+                    else:
+                        time.sleep(RETRY_DELAY)
                     continue
 
                 return {
@@ -109,21 +224,13 @@ class AnalystEarningsFetcher:
             latest = recs.iloc[-1] if len(recs) > 0 else None
 
             if latest is not None:
+                # 5区分の件数を一括で取り出し（欠損は0）
+                counts = pd.to_numeric(latest.reindex(RECOMMENDATION_COLUMNS.values()), errors='coerce').fillna(0).astype(int)
                 return {
                     "has_data": True,
                     "period": str(latest.name) if hasattr(latest, 'name') else None,
-                    "strong_buy": int(latest.get('strongBuy', 0) or 0),
-                    "buy": int(latest.get('buy', 0) or 0),
-                    "hold": int(latest.get('hold', 0) or 0),
-                    "sell": int(latest.get('sell', 0) or 0),
-                    "strong_sell": int(latest.get('strongSell', 0) or 0),
-                    "total_analysts": int(
-                        (latest.get('strongBuy', 0) or 0) +
-                        (latest.get('buy', 0) or 0) +
-                        (latest.get('hold', 0) or 0) +
-                        (latest.get('sell', 0) or 0) +
-                        (latest.get('strongSell', 0) or 0)
-                    ),
+                    **{key: int(count) for key, count in zip(RECOMMENDATION_COLUMNS, counts)},
+                    "total_analysts": int(counts.sum()),
                     # info からの補足データ
                     "recommendation_key": self.info.get("recommendationKey", ""),
                     "recommendation_mean": self.info.get("recommendationMean"),
@@ -230,32 +337,23 @@ class AnalystEarningsFetcher:
             # 今日の日付
             today = pd.Timestamp.now().tz_localize(None)
 
-            # 将来の決算日（次回決算）
-            future_earnings = []
-            past_earnings = []
-
-            for idx, row in earnings.iterrows():
-                # インデックスが日付
-                date = idx
-                if hasattr(date, 'tz_localize'):
-                    date = date.tz_localize(None) if date.tzinfo else date
-                elif hasattr(date, 'replace'):
-                    date = date.replace(tzinfo=None)
-
-                entry = {
-                    "date": str(date.date()) if hasattr(date, 'date') else str(date)[:10],
-                    "eps_estimate": self._safe_float(row.get('EPS Estimate')),
-                    "eps_actual": self._safe_float(row.get('Reported EPS')),
-                    "surprise_pct": self._safe_float(row.get('Surprise(%)')),
-                }
+            # インデックスが日付（タイムゾーンを外して列単位で比較）
+            dates = pd.DatetimeIndex(earnings.index)
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            is_future = dates >= today
 
-                try:
-                    if pd.Timestamp(date) >= today:
-                        future_earnings.append(entry)
-                    else:
-                        past_earnings.append(entry)
-                except:
-                    past_earnings.append(entry)
+            # EPS列は数値化・丸めを列単位で行い、NaN は None にする
+            values = pd.DataFrame({
+                key: pd.to_numeric(earnings[column], errors='coerce').to_numpy() if column in earnings.columns else np.nan
+                for key, column in EARNINGS_COLUMNS.items()
+            }, index=range(len(earnings))).round(2)
+            values = values.astype(object).where(values.notna(), None)
+            values.insert(0, "date", dates.strftime('%Y-%m-%d'))
+
+            # 将来の決算日（次回決算）と過去の決算日
+            future_earnings = values[is_future].to_dict("records")
+            past_earnings = values[~is_future].to_dict("records")
 
             # 次回決算（最も近い将来の日付）
             next_earnings = future_earnings[0] if future_earnings else None
@@ -275,16 +373,39 @@ class AnalystEarningsFetcher:
                 print(f"    Earnings dates error: {e}")
             return {"has_data": False, "error": str(e)}
 
-    def _safe_float(self, value):
-        """安全にfloatに変換"""
-        if value is None:
-            return None
-        if pd.isna(value):
-            return None
-        try:
-            return round(float(value), 2)
-        except:
-            return None
+    def _extract_holders(self, holders, top=10):
+        """機関投資家・投資信託の保有者リストを列単位で整形（上位 top 件）"""
+        df = holders.head(top)
+
+        def column(name):
+            if name in df.columns:
+                return pd.to_numeric(df[name], errors='coerce')
+            return pd.Series(np.nan, index=df.index)
+
+        def nullable(series):
+            return series.astype(object).where(series.notna(), None)
+
+        # pctHeld または % Out カラムを取得（yfinanceバージョン差異対応）
+        # 小数(0.15)ならx100、既にパーセント(15.0)ならそのまま
+        pct_held = column("pctHeld").fillna(column("% Out"))
+        pct_held = pct_held.where(pct_held >= 1, pct_held * 100).round(2)
+        pct_change = column("pctChange")
+        pct_change = pct_change.where(pct_change.abs() >= 1, pct_change * 100).round(2)
+
+        if "Date Reported" in df.columns:
+            reported = df["Date Reported"]
+            date_reported = reported.astype(str).str[:10].where(reported.notna())
+        else:
+            date_reported = pd.Series(None, index=df.index, dtype=object)
+
+        return pd.DataFrame({
+            "holder": df["Holder"].astype(str) if "Holder" in df.columns else "",
+            "shares": nullable(np.trunc(column("Shares")).astype("Int64")),
+            "date_reported": nullable(date_reported),
+            "pct_held": nullable(pct_held),
+            "pct_change": nullable(pct_change),
+            "value": nullable(np.trunc(column("Value")).astype("Int64")),
+        }, index=df.index).to_dict("records")
 
     def _get_shareholders(self):
         """株主構成を取得"""
@@ -303,30 +424,35 @@ class AnalystEarningsFetcher:
                 major_holders = self.ticker.major_holders
                 if major_holders is not None and not major_holders.empty:
                     # 標準的なyfinanceの順序: [0]=Insider, [1]=Institutions, [2]=Float held by Inst, [3]=Num of Inst
-                    for idx, row in major_holders.iterrows():
-                        label = str(row.iloc[1]).lower() if len(row) > 1 else ""
-                        value = row.iloc[0]
+                    # 値は列単位で数値化（小数(0.15)ならx100、既にパーセント(15.0)ならそのまま）
+                    values = pd.to_numeric(major_holders.iloc[:, 0], errors='coerce')
+                    values = values.where(values >= 1, values * 100).round(2)
+                    pcts = values.astype(object).where(values.notna(), None).tolist()
+
+                    if major_holders.shape[1] > 1:
+                        labels = major_holders.iloc[:, 1].astype(str)
+                    else:
+                        labels = pd.Series("", index=major_holders.index)
 
-                        # ラベルベースのマッチング
-                        if "insider" in label:
-                            result["insider_pct"] = self._safe_float(value * 100) if value < 1 else self._safe_float(value)
-                        elif "institution" in label and "float" not in label:
-                            result["institution_pct"] = self._safe_float(value * 100) if value < 1 else self._safe_float(value)
+                    result["major_holders"] = [
+                        {"label": label, "value": pct} for label, pct in zip(labels, pcts)
+                    ]
 
-                        result["major_holders"].append({
-                            "label": str(row.iloc[1]) if len(row) > 1 else "",
-                            "value": self._safe_float(value * 100) if value and value < 1 else self._safe_float(value)
-                        })
+                    # ラベルベースのマッチング（該当行が複数あれば最後の行）
+                    lower = labels.str.lower()
+                    is_insider = lower.str.contains("insider").to_numpy()
+                    is_institution = (lower.str.contains("institution") & ~lower.str.contains("float")).to_numpy() & ~is_insider
+                    if is_insider.any():
+                        result["insider_pct"] = pcts[np.flatnonzero(is_insider)[-1]]
+                    if is_institution.any():
+                        result["institution_pct"] = pcts[np.flatnonzero(is_institution)[-1]]
 
                     # ラベルが空の場合、位置ベースで取得（日本株対応）
                     # yfinanceの標準順序: [0]=Insider%, [1]=Institutions%, [2]=Float%, [3]=Num of Inst
-                    if result["insider_pct"] is None and len(major_holders) >= 1:
-                        val = major_holders.iloc[0, 0]
-                        # 小数(0.15)ならx100、既にパーセント(15.0)ならそのまま
-                        result["insider_pct"] = self._safe_float(val * 100) if val and val < 1 else self._safe_float(val)
-                    if result["institution_pct"] is None and len(major_holders) >= 2:
-                        val = major_holders.iloc[1, 0]
-                        result["institution_pct"] = self._safe_float(val * 100) if val and val < 1 else self._safe_float(val)
+                    if result["insider_pct"] is None and len(pcts) >= 1:
+                        result["insider_pct"] = pcts[0]
+                    if result["institution_pct"] is None and len(pcts) >= 2:
+                        result["institution_pct"] = pcts[1]
 
                     result["has_data"] = True
             except Exception as e:
@@ -337,19 +463,7 @@ class AnalystEarningsFetcher:
             try:
                 inst_holders = self.ticker.institutional_holders
                 if inst_holders is not None and not inst_holders.empty:
-                    for idx, row in inst_holders.head(10).iterrows():
-                        # pctHeld または % Out カラムを取得（yfinanceバージョン差異対応）
-                        pct_held = row.get("pctHeld") if pd.notna(row.get("pctHeld")) else row.get("% Out")
-                        pct_change = row.get("pctChange") if pd.notna(row.get("pctChange")) else None
-                        holder = {
-                            "holder": str(row.get("Holder", "")),
-                            "shares": int(row.get("Shares", 0)) if pd.notna(row.get("Shares")) else None,
-                            "date_reported": str(row.get("Date Reported", ""))[:10] if pd.notna(row.get("Date Reported")) else None,
-                            "pct_held": self._safe_float(pct_held * 100) if pd.notna(pct_held) and pct_held < 1 else self._safe_float(pct_held),
-                            "pct_change": self._safe_float(pct_change * 100) if pd.notna(pct_change) and abs(pct_change) < 1 else self._safe_float(pct_change),
-                            "value": int(row.get("Value", 0)) if pd.notna(row.get("Value")) else None
-                        }
-                        result["institutional_holders"].append(holder)
+                    result["institutional_holders"] = self._extract_holders(inst_holders)
                     result["has_data"] = True
             except Exception as e:
                 if self.verbose:
@@ -359,19 +473,7 @@ class AnalystEarningsFetcher:
             try:
                 mf_holders = self.ticker.mutualfund_holders
                 if mf_holders is not None and not mf_holders.empty:
-                    for idx, row in mf_holders.head(10).iterrows():
-                        # pctHeld または % Out カラムを取得（yfinanceバージョン差異対応）
-                        pct_held = row.get("pctHeld") if pd.notna(row.get("pctHeld")) else row.get("% Out")
-                        pct_change = row.get("pctChange") if pd.notna(row.get("pctChange")) else None
-                        holder = {
-                            "holder": str(row.get("Holder", "")),
-                            "shares": int(row.get("Shares", 0)) if pd.notna(row.get("Shares")) else None,
-                            "date_reported": str(row.get("Date Reported", ""))[:10] if pd.notna(row.get("Date Reported")) else None,
-                            "pct_held": self._safe_float(pct_held * 100) if pd.notna(pct_held) and pct_held < 1 else self._safe_float(pct_held),
-                            "pct_change": self._safe_float(pct_change * 100) if pd.notna(pct_change) and abs(pct_change) < 1 else self._safe_float(pct_change),
-                            "value": int(row.get("Value", 0)) if pd.notna(row.get("Value")) else None
-                        }
-                        result["mutualfund_holders"].append(holder)
+                    result["mutualfund_holders"] = self._extract_holders(mf_holders)
                     result["has_data"] = True
             except Exception as e:
                 if self.verbose:
@@ -385,6 +487,23 @@ class AnalystEarningsFetcher:
             return {"has_data": False, "error": str(e)}
 
 
+# JSONの書き出しはorjsonがあれば高速に処理（なければ標準のjson）
+try:
+    import orjson
+
+    def json_dumps_pretty(data):
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+    def json_dumps_line(data):
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+except ImportError:
+    def json_dumps_pretty(data):
+        return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def json_dumps_line(data):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8') + b"\n"
+
+
 def save_to_json(data, code, output_dir):
     """JSONファイルに保存"""
     if data is None:
@@ -393,93 +512,172 @@ def save_to_json(data, code, output_dir):
     output_file = os.path.join(output_dir, f"{code}.json")
 
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(json_dumps_pretty(data))
         return True
     except Exception as e:
         return False
 
 
+def fetch_wordpress_page(page, per_page):
+    """企業一覧の1ページ分を取得（失敗時は再試行）
+
+    戻り値: (企業リスト, 総ページ数)。範囲外のページ（400）は空リスト、取得失敗は None
+    再試行の間隔は RETRY_DELAY から倍々に延ばす。
+    """
+    params = {
+        "per_page": per_page,
+        "page": page,
+        "_fields": "id,stock_code",
+        "status": "publish"
+    }
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            response = WP_SESSION.get(
+                WP_API_URL,
+                params=params,
+                timeout=REQUEST_TIMEOUT
+            )
+
+            if response.status_code == 200:
+                total_pages = int(response.headers.get('X-WP-TotalPages', MAX_PAGES))
+                return response.json(), total_pages
+
+            elif response.status_code == 400:
+                return [], 0
+
+            else:
+                print(f"   ⚠️  HTTPエラー: {response.status_code}")
+
+        except Exception as e:
+            print(f"   ❌ 接続エラー: {e}")
+
+        if attempt < MAX_RETRIES:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+    return None, 0
+
+
 def fetch_companies_from_wordpress():
-    """WordPress REST APIから登録済み企業の証券コードを取得"""
+    """WordPress REST APIから登録済み企業の証券コードを取得（2ページ目以降は並列取得）
+
+    再試行しても取得できないページがあれば、途中までの一覧では処理せず空リストを返す
+    （呼び出し側でエラー終了する）。
+    """
     print(f"📥 WordPress REST APIから企業リスト取得中...")
     print(f"   API URL: {WP_API_URL}")
 
-    stock_codes = []
-    offset = 0
     per_page = 100
-    max_companies = MAX_PAGES * per_page
-
-    while offset < max_companies:
-        params = {
-            "per_page": per_page,
-            "offset": offset,
-            "_fields": "id,stock_code",
-            "status": "publish"
-        }
 
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                response = requests.get(
-                    WP_API_URL,
-                    params=params,
-                    timeout=REQUEST_TIMEOUT
-                )
-
-                if response.status_code == 200:
-                    companies = response.json()
-
-                    if not companies:
-                        print(f"   ✅ 取得完了: {len(stock_codes)}社")
-                        return stock_codes
-
-                    for company in companies:
-                        code = company.get('stock_code', '')
-                        if code and isinstance(code, str) and len(code) == 4 and code.isalnum():
-                            stock_codes.append(code)
-
-                    offset += per_page
-                    time.sleep(0.3)
-                    break
-
-                elif response.status_code == 400:
-                    print(f"   ✅ 取得完了: {len(stock_codes)}社")
-                    return stock_codes
-
-                else:
-                    print(f"   ⚠️  HTTPエラー: {response.status_code}")
-                    if attempt < MAX_RETRIES:
-                        time.sleep(2)
-                    else:
-                        break
+    # 1ページ目で総ページ数（X-WP-TotalPages）を確認
+    companies, total_pages = fetch_wordpress_page(1, per_page)
+    pages = [companies]
 
-            except Exception as e:
-                print(f"   ❌ 接続エラー: {e}")
-                if attempt < MAX_RETRIES:
-                    time.sleep(2)
-                else:
-                    break
+    # 安全装置（最大 MAX_PAGES ページ）
+    total_pages = min(total_pages, MAX_PAGES)
+
+    # 残りのページを並列取得（順序はページ順に保持）
+    if companies and total_pages > 1:
+        with ThreadPoolExecutor(max_workers=WP_PAGE_WORKERS) as executor:
+            results = executor.map(
+                lambda page: fetch_wordpress_page(page, per_page),
+                range(2, total_pages + 1)
+            )
+            pages.extend(page_companies for page_companies, _ in results)
+
+    failed_pages = [page for page, companies in enumerate(pages, 1) if companies is None]
+    if failed_pages:
+        print(f"   ❌ 取得失敗ページ: {', '.join(map(str, failed_pages))}（一覧が欠けるため中断）")
+        return []
+
+    stock_codes = []
+    for companies in pages:
+        # 空ページ（範囲外）で終了
+        if not companies:
+            break
+
+        for company in companies:
+            code = company.get('stock_code', '')
+            if code and isinstance(code, str) and len(code) == 4 and code.isalnum():
+                stock_codes.append(code)
 
     print(f"   ✅ 取得完了: {len(stock_codes)}社")
     return stock_codes
 
 
-def process_company(code):
-    """並列処理用のラッパー関数"""
-    fetcher = AnalystEarningsFetcher(code, verbose=False)
+def build_batch_tickers(codes):
+    """バッチ内の銘柄を yf.Tickers でまとめて作成（Cookie・crumb のセッションを共有）"""
+    tickers = create_tickers(" ".join(f"{code}.T" for code in codes))
+    return {code: tickers.tickers.get(f"{code}.T".upper()) for code in codes}
+
+
+class JsonWriter:
+    """JSON書き出し専用スレッド（取得スレッドはキューに積むだけでディスクを待たない）
+
+    ndjson_path を指定すると、企業ごとのJSONではなく1ファイルに1行1社で追記する。
+    書き込みに失敗した件数は failed に数える（このスレッドだけが更新する）。
+    """
+
+    def __init__(self, output_dir, maxsize=256, ndjson_path=None):
+        self.output_dir = output_dir
+        self.failed = 0
+        self.ndjson = open(ndjson_path, 'wb') if ndjson_path else None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, code, data):
+        self.queue.put((code, data))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            code, data = item
+            if self.ndjson is not None:
+                try:
+                    self.ndjson.write(json_dumps_line(data))
+                except Exception as e:
+                    self.failed += 1
+            elif not save_to_json(data, code, self.output_dir):
+                self.failed += 1
+
+    def close(self):
+        """キューに残った分を書き終えるまで待つ"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.ndjson is not None:
+            self.ndjson.close()
+
+
+def find_fresh_codes(output_dir, hours):
+    """保存から hours 時間以内のJSONがある証券コードを返す（ディレクトリを1回走査）"""
+    cutoff = time.time() - hours * 3600
+    try:
+        with os.scandir(output_dir) as entries:
+            return {
+                entry.name[:-len('.json')]
+                for entry in entries
+                if entry.name.endswith('.json') and entry.stat().st_mtime > cutoff
+            }
+    except FileNotFoundError:
+        return set()
+
+
+def process_company(code, ticker=None, writer=None):
+    """並列処理用のラッパー関数（writer があれば書き出しは専用スレッドに任せる）"""
+    fetcher = AnalystEarningsFetcher(code, verbose=False, ticker=ticker)
     data = fetcher.fetch()
     success = False
 
     if data.get("success"):
-        success = save_to_json(data, code, OUTPUT_DIR)
-
-    # スレッドセーフにカウンターを更新
-    with lock:
-        progress_counter["total"] += 1
-        if success:
-            progress_counter["success"] += 1
+        if writer is not None:
+            writer.put(code, data)
+            success = True
         else:
-            progress_counter["error"] += 1
+            success = save_to_json(data, code, OUTPUT_DIR)
 
     return {"code": code, "success": success, "data": data}
 
@@ -490,6 +688,8 @@ def main():
     parser.add_argument('--skip', type=int, default=0, help='スキップする企業数')
     parser.add_argument('--ticker', type=str, help='特定の銘柄のみ取得')
     parser.add_argument('--workers', type=int, default=MAX_WORKERS, help=f'並列数（デフォルト: {MAX_WORKERS}）')
+    parser.add_argument('--ndjson', type=str, help='企業ごとのJSONの代わりに1ファイル（1行1社）へ出力')
+    parser.add_argument('--force', action='store_true', help=f'{FRESH_HOURS:g}時間以内に取得済みの企業も再取得')
     args = parser.parse_args()
 
     print("=" * 70)
@@ -537,6 +737,20 @@ def main():
         stock_codes = stock_codes[:args.limit]
         print(f"📊 処理対象: {len(stock_codes)}社（limit: {args.limit}）")
 
+    # 直近に取得済みの企業はスキップ（--force で全件取得、--ndjson は毎回全件を1ファイルに出力）
+    fresh_skipped = 0
+    if not args.force and not args.ndjson:
+        fresh_codes = find_fresh_codes(OUTPUT_DIR, FRESH_HOURS)
+        before = len(stock_codes)
+        stock_codes = [code for code in stock_codes if code not in fresh_codes]
+        fresh_skipped = before - len(stock_codes)
+        if fresh_skipped:
+            print(f"⏭️  {FRESH_HOURS:g}時間以内に取得済みの{fresh_skipped}社をスキップ")
+
+    if not stock_codes:
+        print("✅ 取得が必要な企業はありません")
+        return
+
     total = len(stock_codes)
     num_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
     batch_wait_time = (num_batches - 1) * BATCH_DELAY
@@ -555,43 +769,68 @@ def main():
     print(f"バッチ数: {total_batches}（{BATCH_SIZE}社/バッチ、{BATCH_DELAY}秒間隔）")
     print()
 
-    for batch_idx, batch in enumerate(batches, 1):
-        print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
+    # JSONの書き出しは専用スレッドでまとめて行う
+    writer = JsonWriter(OUTPUT_DIR, ndjson_path=args.ndjson)
 
-        # 並列処理
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_code = {executor.submit(process_company, code): code for code in batch}
+    progress_bar = tqdm(total=total, desc="Fetching", mininterval=5) if tqdm is not None else None
+
+    # スレッドは全バッチで使い回す（バッチごとにプールを作り直さない）
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_idx, batch in enumerate(batches, 1):
+            print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
+
+            # 並列処理（バッチ内の yf.Ticker はまとめて作成して各スレッドに渡す）
+            batch_tickers = build_batch_tickers(batch)
+            future_to_code = {
+                executor.submit(process_company, code, batch_tickers[code], writer): code
+                for code in batch
+            }
 
             for future in as_completed(future_to_code):
                 try:
-                    future.result()
+                    success = future.result()["success"]
                 except Exception as e:
-                    with lock:
-                        progress_counter["total"] += 1
-                        progress_counter["error"] += 1
+                    success = False
 
-                # 進捗表示
+                # カウンター更新（このループだけが更新する）
+                progress_counter["total"] += 1
+                progress_counter["success" if success else "error"] += 1
+
+                # 進捗表示（書き込み失敗分は成功から失敗へ付け替えて表示）
                 current_total = progress_counter["total"]
-                if current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
+                if progress_bar is not None:
+                    write_failed = writer.failed
+                    progress_bar.set_postfix(
+                        ok=progress_counter['success'] - write_failed,
+                        err=progress_counter['error'] + write_failed,
+                        refresh=False
+                    )
+                    progress_bar.update(1)
+                elif current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
                     elapsed = (datetime.now() - start_time).total_seconds()
                     if current_total > 0:
                         eta = (elapsed / current_total) * (total - current_total) / 60
                     else:
                         eta = 0
-                    print(f"[{current_total:4}/{total}] ✅ {progress_counter['success']} / ❌ {progress_counter['error']} | 経過: {elapsed/60:.1f}分 | ETA: {eta:.0f}分")
+                    write_failed = writer.failed
+                    print(f"[{current_total:4}/{total}] ✅ {progress_counter['success'] - write_failed} / ❌ {progress_counter['error'] + write_failed} | 経過: {elapsed/60:.1f}分 | ETA: {eta:.0f}分")
                     last_progress_print = current_total
 
-        # バッチ間の待機（最後のバッチ以外）
-        if batch_idx < total_batches:
-            print(f"    💤 {BATCH_DELAY}秒待機...")
-            time.sleep(BATCH_DELAY)
+            # バッチ間の待機（最後のバッチ以外）
+            if batch_idx < total_batches:
+                print(f"    💤 {BATCH_DELAY}秒待機...")
+                time.sleep(BATCH_DELAY)
+
+    if progress_bar is not None:
+        progress_bar.close()
+    writer.close()
 
     # 完了サマリー
     end_time = datetime.now()
     elapsed = (end_time - start_time).total_seconds()
 
-    success_count = progress_counter["success"]
-    error_count = progress_counter["error"]
+    success_count = progress_counter["success"] - writer.failed
+    error_count = progress_counter["error"] + writer.failed
 
     print()
     print("=" * 70)
@@ -599,8 +838,10 @@ def main():
     print(f"所要時間: {elapsed/60:.1f}分 ({elapsed:.0f}秒)")
     print(f"成功: {success_count}社 ({success_count/total*100:.1f}%)")
     print(f"失敗: {error_count}社")
+    if fresh_skipped:
+        print(f"取得済みのためスキップ: {fresh_skipped}社")
     print(f"並列数: {workers}")
-    print(f"出力先: {OUTPUT_DIR}/")
+    print(f"出力先: {args.ndjson or OUTPUT_DIR + '/'}")
     print("=" * 70)
 
 
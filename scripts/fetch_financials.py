@@ -14,6 +14,7 @@ Japan IR - 財務データ取得スクリプト（並列処理版）
 
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import json
 import os
 import sys
@@ -24,6 +25,12 @@ from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
+# 進捗表示はtqdmがあれば使用（なければ PROGRESS_INTERVAL ごとに print）
+try:
+    from tqdm.auto import tqdm
+except ImportError:
+    tqdm = None
+
 # 設定
 INPUT_CSV_WORDPRESS = "data/wordpress_companies.csv"
 INPUT_CSV_FALLBACK = "data/japan_companies_latest.csv"
@@ -34,19 +41,91 @@ RETRY_DELAY = 5
 PROGRESS_INTERVAL = 20
 BATCH_SIZE = 50  # バッチサイズ
 BATCH_DELAY = 45  # バッチ間の待機秒数
+MA_PERIODS = (5, 25, 75, 200)  # MA乖離率の期間（日）
+FRESH_HOURS = float(os.getenv('FINANCIALS_FRESH_HOURS', '144'))  # この時間内に保存したJSONは再取得しない（週1回の実行では前回分を必ず更新）
+
+# yfinance用のディスクキャッシュ（requests_cache があれば使用、エンドポイントごとの保持秒数）
+YF_CACHE_PATH = os.getenv('YF_CACHE_PATH', 'data/.yf_cache')
+YF_INFO_TTL = int(os.getenv('YF_INFO_TTL', '3600'))  # quoteSummary（info）: 1時間
+YF_STATEMENTS_TTL = int(os.getenv('YF_STATEMENTS_TTL', str(30 * 86400)))  # 財務諸表: 30日（更新は四半期ごと）
+YF_CHART_TTL = int(os.getenv('YF_CHART_TTL', str(12 * 3600)))  # 日足・配当: 12時間
 
 # スレッドセーフなカウンター
 lock = threading.Lock()
 progress_counter = {"success": 0, "error": 0, "total": 0}
 
 
+def build_cached_session():
+    """エンドポイント別TTLのディスクキャッシュ付きセッションを作成（requests_cache がなければ None）
+
+    財務諸表は四半期ごとにしか変わらないため、再実行ではほぼ通信せずに済む。
+    Cookie・crumb など認証系のURLはキャッシュしない。
+    fundamentals-timeseries のURLには実行時刻の period2 とセッションごとの crumb が入るため、
+    この2つはキャッシュキーから除外する（除外しないと日をまたいで一度もヒットしない）。
+    """
+    try:
+        from requests_cache import CachedSession, SQLiteCache, DO_NOT_CACHE
+    except ImportError:
+        return None
+
+    return CachedSession(
+        backend=SQLiteCache(YF_CACHE_PATH),
+        expire_after=DO_NOT_CACHE,
+        urls_expire_after={
+            '*/quoteSummary/*': YF_INFO_TTL,
+            '*/fundamentals-timeseries/*': YF_STATEMENTS_TTL,
+            '*/finance/chart/*': YF_CHART_TTL,
+        },
+        # 送信はするがキャッシュキーには含めないパラメータ
+        ignored_parameters=['period2', 'crumb'],
+    )
+
+
+def build_curl_session():
+    """curl_cffi のChrome偽装セッションを作成（curl_cffi がなければ None）"""
+    try:
+        from curl_cffi import requests as curl_requests
+    except ImportError:
+        return None
+    return curl_requests.Session(impersonate="chrome")
+
+
+def build_yf_session():
+    """全スレッド・全銘柄で共有するyfinance用セッションを作成（使えるものがなければ None）
+
+    キャッシュ付きセッションを優先し、yfinanceが受け付けなければ curl_cffi のセッションを使う。
+    1つのセッションで接続・Cookie・crumb を使い回し、銘柄ごとのハンドシェイクを避ける。
+    """
+    for build in (build_cached_session, build_curl_session):
+        session = build()
+        if session is None:
+            continue
+        # curl_cffi のセッションしか受け付けないyfinanceでは requests のセッションは使えない（Ticker作成は通信なし）
+        try:
+            yf.Ticker("7203.T", session=session)
+        except Exception as e:
+            continue
+        return session
+    return None
+
+
+YF_SESSION = build_yf_session()
+
+
+def session_kwargs():
+    """yfinance呼び出しに渡すセッション引数（キャッシュ付きセッションがなければ空）"""
+    return {"session": YF_SESSION} if YF_SESSION is not None else {}
+
+
 class FinancialDataFetcher:
     """財務データ取得クラス"""
 
-    def __init__(self, ticker_code, verbose=False):
+    def __init__(self, ticker_code, verbose=False, ticker=None, hist=None):
         self.ticker_code = str(ticker_code).replace('.T', '')
         self.ticker_full = f"{self.ticker_code}.T"
-        self.ticker = yf.Ticker(self.ticker_full)
+        # バッチ単位で作成済みの yf.Ticker・一括取得済みの日足があれば再利用
+        self.ticker = ticker if ticker is not None else yf.Ticker(self.ticker_full, **session_kwargs())
+        self.hist = hist
         self.info = {}
         self.verbose = verbose
 
@@ -59,8 +138,10 @@ class FinancialDataFetcher:
                 if not self.info or len(self.info) <= 1:
                     raise Exception("Empty response from yfinance")
 
-                # 履歴データ取得（MA計算用）
-                hist_1y = self.ticker.history(period="1y", interval="1d")
+                # 履歴データ取得（MA計算用、一括取得に含まれなかった銘柄だけ個別に取得）
+                # 取得できた日足は self.hist に保持し、リトライ時に再ダウンロードしない
+                if self.hist is None or self.hist.empty:
+                    self.hist = self.ticker.history(period="1y", interval="1d")
 
                 result = {
                     "success": True,
@@ -69,7 +150,7 @@ class FinancialDataFetcher:
                     "ticker_full": self.ticker_full,
                     "company_name": self.info.get("shortName", ""),
                     "company_info": self._get_company_info(),
-                    "price_trend": self._calculate_ma_deviation(hist_1y),
+                    "price_trend": self._calculate_ma_deviation(self.hist),
                     "financials": self._get_financials(),
                     "dividends": self._get_dividends(),
                 }
@@ -106,35 +187,32 @@ class FinancialDataFetcher:
         if not current_price:
             return self._empty_ma_deviation()
 
-        close_prices = hist['Close']
-
-        def calc(period):
-            if len(close_prices) >= period:
-                ma = close_prices.tail(period).mean()
-                deviation = ((current_price - ma) / ma) * 100
-                return {
-                    "ma_value": round(float(ma), 2),
-                    "deviation": round(float(deviation), 2),
-                    "trend": "up" if deviation > 0 else "down"
-                }
-            return {"ma_value": 0, "deviation": 0, "trend": "neutral"}
-
-        return {
-            "ma_5": calc(5),
-            "ma_25": calc(25),
-            "ma_75": calc(75),
-            "ma_200": calc(200),
-        }
+        # 累積和を1回だけ計算し、各期間の平均は末尾との差分で求める（欠損日は除いて平均）
+        close = hist['Close'].to_numpy(dtype=float)
+        valid = ~np.isnan(close)
+        csum = np.concatenate(([0.0], np.cumsum(np.where(valid, close, 0.0))))
+        ccount = np.concatenate(([0], np.cumsum(valid)))
+        neutral = {"ma_value": 0, "deviation": 0, "trend": "neutral"}
+
+        result = {}
+        for period in MA_PERIODS:
+            count = ccount[-1] - ccount[-period - 1] if len(close) >= period else 0
+            if not count:
+                result[f"ma_{period}"] = neutral.copy()
+                continue
+            ma = (csum[-1] - csum[-period - 1]) / count
+            deviation = ((current_price - ma) / ma) * 100
+            result[f"ma_{period}"] = {
+                "ma_value": round(float(ma), 2),
+                "deviation": round(float(deviation), 2),
+                "trend": "up" if deviation > 0 else "down"
+            }
+        return result
 
     def _empty_ma_deviation(self):
         """空のMA乖離率データ"""
         empty = {"ma_value": 0, "deviation": 0, "trend": "neutral"}
-        return {
-            "ma_5": empty.copy(),
-            "ma_25": empty.copy(),
-            "ma_75": empty.copy(),
-            "ma_200": empty.copy(),
-        }
+        return {f"ma_{period}": empty.copy() for period in MA_PERIODS}
 
     def _get_company_info(self):
         """企業基本情報を取得"""
@@ -176,48 +254,43 @@ class FinancialDataFetcher:
             years_data = []
 
             if not income_stmt.empty:
-                for col in income_stmt.columns[:5]:
+                # 各財務諸表を対象の決算期に揃えて項目ごとの値リストにしておく（セル単位の .loc を避ける）
+                columns = income_stmt.columns[:5]
+                inc = self._statement_rows(income_stmt, columns)
+                bal = self._statement_rows(balance_sheet, columns)
+                cf = self._statement_rows(cashflow, columns)
+                zeros = [0.0] * len(columns)
+
+                for i, col in enumerate(columns):
                     year = col.year if hasattr(col, 'year') else str(col)[:4]
 
                     # 損益計算書
-                    revenue = self._safe_get(income_stmt, 'Total Revenue', col)
-                    gross_profit = self._safe_get(income_stmt, 'Gross Profit', col)
-                    operating_income = self._safe_get(income_stmt, 'Operating Income', col)
-                    ebit = self._safe_get(income_stmt, 'EBIT', col)
-                    net_income = self._safe_get(income_stmt, 'Net Income', col)
-                    eps = self._safe_get(income_stmt, 'Diluted EPS', col)
-
-                    # 貸借対照表
-                    total_assets = 0
-                    total_equity = 0
-                    total_debt = 0
-                    total_cash = 0
-                    current_assets = 0
-                    current_liabilities = 0
-                    if not balance_sheet.empty and col in balance_sheet.columns:
-                        total_assets = self._safe_get(balance_sheet, 'Total Assets', col)
-                        total_equity = (self._safe_get(balance_sheet, 'Stockholders Equity', col) or
-                                       self._safe_get(balance_sheet, 'Total Stockholder Equity', col))
-                        total_debt = self._safe_get(balance_sheet, 'Total Debt', col)
-                        total_cash = (self._safe_get(balance_sheet, 'Cash And Cash Equivalents', col) or
-                                     self._safe_get(balance_sheet, 'Cash', col))
-                        current_assets = self._safe_get(balance_sheet, 'Current Assets', col)
-                        current_liabilities = self._safe_get(balance_sheet, 'Current Liabilities', col)
-
-                    # キャッシュフロー
-                    operating_cf = 0
-                    investing_cf = 0
-                    financing_cf = 0
-                    free_cf = 0
-                    if not cashflow.empty and col in cashflow.columns:
-                        operating_cf = (self._safe_get(cashflow, 'Operating Cash Flow', col) or
-                                       self._safe_get(cashflow, 'Total Cash From Operating Activities', col))
-                        investing_cf = (self._safe_get(cashflow, 'Investing Cash Flow', col) or
-                                       self._safe_get(cashflow, 'Total Cashflows From Investing Activities', col))
-                        financing_cf = (self._safe_get(cashflow, 'Financing Cash Flow', col) or
-                                       self._safe_get(cashflow, 'Total Cash From Financing Activities', col))
-                        free_cf = (self._safe_get(cashflow, 'Free Cash Flow', col) or
-                                  (operating_cf + self._safe_get(cashflow, 'Capital Expenditure', col)))
+                    revenue = inc.get('Total Revenue', zeros)[i]
+                    gross_profit = inc.get('Gross Profit', zeros)[i]
+                    operating_income = inc.get('Operating Income', zeros)[i]
+                    ebit = inc.get('EBIT', zeros)[i]
+                    net_income = inc.get('Net Income', zeros)[i]
+                    eps = inc.get('Diluted EPS', zeros)[i]
+
+                    # 貸借対照表（該当する決算期がなければ0）
+                    total_assets = bal.get('Total Assets', zeros)[i]
+                    total_equity = (bal.get('Stockholders Equity', zeros)[i] or
+                                    bal.get('Total Stockholder Equity', zeros)[i])
+                    total_debt = bal.get('Total Debt', zeros)[i]
+                    total_cash = (bal.get('Cash And Cash Equivalents', zeros)[i] or
+                                  bal.get('Cash', zeros)[i])
+                    current_assets = bal.get('Current Assets', zeros)[i]
+                    current_liabilities = bal.get('Current Liabilities', zeros)[i]
+
+                    # キャッシュフロー（該当する決算期がなければ0）
+                    operating_cf = (cf.get('Operating Cash Flow', zeros)[i] or
+                                    cf.get('Total Cash From Operating Activities', zeros)[i])
+                    investing_cf = (cf.get('Investing Cash Flow', zeros)[i] or
+                                    cf.get('Total Cashflows From Investing Activities', zeros)[i])
+                    financing_cf = (cf.get('Financing Cash Flow', zeros)[i] or
+                                    cf.get('Total Cash From Financing Activities', zeros)[i])
+                    free_cf = (cf.get('Free Cash Flow', zeros)[i] or
+                               (operating_cf + cf.get('Capital Expenditure', zeros)[i]))
 
                     # 比率計算
                     operating_margin = (operating_income / revenue * 100) if revenue else 0
@@ -302,17 +375,13 @@ class FinancialDataFetcher:
         except Exception as e:
             return {"history": [], "has_data": False, "error": str(e)}
 
-    def _safe_get(self, df, row_name, col):
-        """DataFrameから安全に値を取得"""
-        try:
-            if row_name in df.index:
-                val = df.loc[row_name, col]
-                if pd.isna(val):
-                    return 0
-                return float(val)
-        except:
-            pass
-        return 0
+    def _statement_rows(self, df, columns):
+        """財務諸表を columns の決算期に揃え、項目名 → 値リスト（欠損・該当期なしは0）に変換"""
+        if df is None or df.empty:
+            return {}
+        aligned = df[~df.index.duplicated()].reindex(columns=columns)
+        values = np.nan_to_num(aligned.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float))
+        return dict(zip(aligned.index, values.tolist()))
 
     def _format_large_number(self, value):
         """大きな数値をフォーマット"""
@@ -332,29 +401,94 @@ class FinancialDataFetcher:
             return f"{sign}¥{abs_value:,.0f}"
 
 
-def save_to_json(data, code, output_dir):
-    """JSONファイルに保存"""
+# JSONの書き出しはorjsonがあれば高速に処理（なければ標準のjson）、既定は空白なしの1行
+try:
+    import orjson
+
+    def json_dumps(data, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+except ImportError:
+    def json_dumps(data, pretty=False):
+        if pretty:
+            return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def save_to_json(data, code, output_dir, pretty=False):
+    """JSONファイルに保存（pretty=True でインデント付き）"""
     if data is None:
         return False
 
     output_file = os.path.join(output_dir, f"{code}.json")
 
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(json_dumps(data, pretty))
         return True
     except Exception as e:
         return False
 
 
-def process_company(code):
+def build_batch_tickers(codes):
+    """バッチ内の銘柄を yf.Tickers でまとめて作成（Cookie・crumb のセッションを共有）"""
+    tickers = yf.Tickers(" ".join(f"{code}.T" for code in codes), **session_kwargs())
+    return {code: tickers.tickers.get(f"{code}.T".upper()) for code in codes}
+
+
+def download_batch_history(codes):
+    """バッチ内の1年分の日足を yf.download で一括取得（MA乖離率用、失敗時は空）"""
+    symbols = [f"{code}.T" for code in codes]
+    try:
+        data = yf.download(symbols, period="1y", interval="1d", group_by="ticker",
+                           auto_adjust=True, threads=True, progress=False, **session_kwargs())
+    except Exception as e:
+        return {}
+
+    if data is None or data.empty:
+        return {}
+
+    histories = {}
+    multi = isinstance(data.columns, pd.MultiIndex)
+    fetched = set(data.columns.get_level_values(0)) if multi else set()
+    for code, symbol in zip(codes, symbols):
+        if multi:
+            if symbol not in fetched:
+                continue
+            hist = data[symbol].dropna(how='all')
+        elif len(symbols) == 1:
+            hist = data.dropna(how='all')
+        else:
+            continue
+        if not hist.empty:
+            histories[code] = hist
+    return histories
+
+
+def find_fresh_codes(output_dir, hours):
+    """保存から hours 時間以内のJSONがある証券コードを返す（ディレクトリを1回走査）"""
+    cutoff = time.time() - hours * 3600
+    try:
+        with os.scandir(output_dir) as entries:
+            return {
+                entry.name[:-len('.json')]
+                for entry in entries
+                if entry.name.endswith('.json') and entry.stat().st_mtime > cutoff
+            }
+    except FileNotFoundError:
+        return set()
+
+
+def process_company(code, ticker=None, hist=None, pretty=False):
     """並列処理用のラッパー関数"""
-    fetcher = FinancialDataFetcher(code, verbose=False)
+    fetcher = FinancialDataFetcher(code, verbose=False, ticker=ticker, hist=hist)
     data = fetcher.fetch()
     success = False
 
     if data.get("success"):
-        success = save_to_json(data, code, OUTPUT_DIR)
+        success = save_to_json(data, code, OUTPUT_DIR, pretty)
 
     # スレッドセーフにカウンターを更新
     with lock:
@@ -373,12 +507,15 @@ def main():
     parser.add_argument('--skip', type=int, default=0, help='スキップする企業数')
     parser.add_argument('--ticker', type=str, help='特定の銘柄のみ取得')
     parser.add_argument('--workers', type=int, default=MAX_WORKERS, help=f'並列数（デフォルト: {MAX_WORKERS}）')
+    parser.add_argument('--pretty', action='store_true', help='JSONをインデント付きで出力（既定は空白なし）')
+    parser.add_argument('--force', action='store_true', help=f'{FRESH_HOURS:g}時間以内に取得済みの企業も再取得')
     args = parser.parse_args()
 
     print("=" * 70)
     print("Japan IR - 財務データ取得（並列処理版）")
     print("=" * 70)
     start_time = datetime.now()
+    start_clock = time.monotonic()  # 経過時間は単調時計で計測（日時の整形は開始・完了時のみ）
     print(f"開始: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"並列数: {args.workers}")
 
@@ -392,7 +529,7 @@ def main():
         data = fetcher.fetch()
 
         if data.get("success"):
-            if save_to_json(data, args.ticker, OUTPUT_DIR):
+            if save_to_json(data, args.ticker, OUTPUT_DIR, args.pretty):
                 print(f"✅ 成功: {args.ticker}")
                 print(f"出力: {OUTPUT_DIR}/{args.ticker}.json")
             else:
@@ -425,6 +562,20 @@ def main():
         stock_codes = stock_codes[:args.limit]
         print(f"📊 処理対象: {len(stock_codes)}社（limit: {args.limit}）")
 
+    # 直近に取得済みの企業はスキップ（--force で全件取得）
+    fresh_skipped = 0
+    if not args.force:
+        fresh_codes = find_fresh_codes(OUTPUT_DIR, FRESH_HOURS)
+        before = len(stock_codes)
+        stock_codes = [code for code in stock_codes if str(code) not in fresh_codes]
+        fresh_skipped = before - len(stock_codes)
+        if fresh_skipped:
+            print(f"⏭️  {FRESH_HOURS:g}時間以内に取得済みの{fresh_skipped}社をスキップ")
+
+    if not stock_codes:
+        print("✅ 取得が必要な企業はありません")
+        return
+
     total = len(stock_codes)
     num_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
     batch_wait_time = (num_batches - 1) * BATCH_DELAY
@@ -435,6 +586,7 @@ def main():
     print()
 
     last_progress_print = 0
+    progress_bar = tqdm(total=total, desc="Fetching", unit="ticker", mininterval=5) if tqdm is not None else None
     workers = args.workers
 
     # バッチ処理（API制限対策）
@@ -443,12 +595,20 @@ def main():
     print(f"バッチ数: {total_batches}（{BATCH_SIZE}社/バッチ、{BATCH_DELAY}秒間隔）")
     print()
 
-    for batch_idx, batch in enumerate(batches, 1):
-        print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
+    # スレッドは全バッチで使い回す（バッチごとにプールを作り直さない）
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_idx, batch in enumerate(batches, 1):
+            print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
 
-        # 並列処理
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_code = {executor.submit(process_company, code): code for code in batch}
+            # MA計算用の日足はバッチ単位で一括取得し、yf.Ticker もまとめて作成して各スレッドに渡す
+            batch_hist = download_batch_history(batch)
+            batch_tickers = build_batch_tickers(batch)
+
+            # 並列処理
+            future_to_code = {
+                executor.submit(process_company, code, batch_tickers[code], batch_hist.get(code), args.pretty): code
+                for code in batch
+            }
 
             for future in as_completed(future_to_code):
                 try:
@@ -460,8 +620,11 @@ def main():
 
                 # 進捗表示
                 current_total = progress_counter["total"]
-                if current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
-                    elapsed = (datetime.now() - start_time).total_seconds()
+                if progress_bar is not None:
+                    progress_bar.set_postfix(ok=progress_counter['success'], err=progress_counter['error'], refresh=False)
+                    progress_bar.update(1)
+                elif current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
+                    elapsed = time.monotonic() - start_clock
                     if current_total > 0:
                         eta = (elapsed / current_total) * (total - current_total) / 60
                     else:
@@ -469,14 +632,17 @@ def main():
                     print(f"[{current_total:4}/{total}] ✅ {progress_counter['success']} / ❌ {progress_counter['error']} | 経過: {elapsed/60:.1f}分 | ETA: {eta:.0f}分")
                     last_progress_print = current_total
 
-        # バッチ間の待機（最後のバッチ以外）
-        if batch_idx < total_batches:
-            print(f"    💤 {BATCH_DELAY}秒待機...")
-            time.sleep(BATCH_DELAY)
+            # バッチ間の待機（最後のバッチ以外）
+            if batch_idx < total_batches:
+                print(f"    💤 {BATCH_DELAY}秒待機...")
+                time.sleep(BATCH_DELAY)
+
+    if progress_bar is not None:
+        progress_bar.close()
 
     # 完了サマリー
     end_time = datetime.now()
-    elapsed = (end_time - start_time).total_seconds()
+    elapsed = time.monotonic() - start_clock
 
     success_count = progress_counter["success"]
     error_count = progress_counter["error"]
@@ -487,6 +653,8 @@ def main():
     print(f"所要時間: {elapsed/60:.1f}分 ({elapsed:.0f}秒)")
     print(f"成功: {success_count}社 ({success_count/total*100:.1f}%)")
     print(f"失敗: {error_count}社")
+    if fresh_skipped:
+        print(f"取得済みのためスキップ: {fresh_skipped}社")
     print(f"並列数: {workers}")
     print(f"出力先: {OUTPUT_DIR}/")
     print("=" * 70)
@@ -11,11 +11,19 @@ import pandas as pd
 import json
 import os
 import time
+import argparse
+import importlib.util
 from datetime import datetime
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
+# 進捗表示はtqdmがあれば使用（なければ PROGRESS_INTERVAL ごとに print）
+try:
+    from tqdm.auto import tqdm
+except ImportError:
+    tqdm = None
+
 # 設定
 INPUT_CSV_WORDPRESS = "data/wordpress_companies.csv"  # WordPress登録企業（優先）
 INPUT_CSV_FALLBACK = "data/japan_companies_latest.csv"  # 全企業（フォールバック）
@@ -27,17 +35,70 @@ HISTORY_PERIOD = "5y"  # 5年分
 PROGRESS_INTERVAL = 20
 BATCH_SIZE = 50  # バッチサイズ
 BATCH_DELAY = 45  # バッチ間の待機秒数
+FRESH_HOURS = float(os.getenv('STOCK_HISTORY_FRESH_HOURS', '20'))  # この時間内に保存したJSONは再取得しない
+
+def build_yf_session():
+    """全スレッドで共有するyfinance用セッションを作成（curl_cffi がなければ None でyfinance既定）
+
+    1つのセッションで接続・Cookie・crumb を使い回し、銘柄ごとのハンドシェイクを避ける。
+    """
+    try:
+        from curl_cffi import requests as curl_requests
+    except ImportError:
+        return None
+
+    session = curl_requests.Session(impersonate="chrome")
+    # セッションを受け付けないyfinanceでは使わない（Ticker作成は通信なし）
+    try:
+        yf.Ticker("7203.T", session=session)
+    except Exception as e:
+        return None
+    return session
+
+YF_SESSION = build_yf_session()
 
 # スレッドセーフなカウンター
 lock = threading.Lock()
 progress_counter = {"success": 0, "error": 0, "total": 0}
 
-def fetch_stock_history(code):
+# 出力キー → yfinance の列名
+OHLCV_COLUMNS = {
+    "open": "Open",
+    "high": "High",
+    "low": "Low",
+    "close": "Close",
+    "volume": "Volume",
+}
+
+def shrink_history(hist):
+    """OHLCV以外の列を落とし、出来高を最小の整数型に縮小（価格は丸め誤差を避けるためfloat64のまま）"""
+    hist = hist[list(OHLCV_COLUMNS.values())]
+    return hist.assign(Volume=pd.to_numeric(hist["Volume"], downcast="unsigned"))
+
+def history_to_frame(hist, date_as_str=True):
+    """株価履歴を出力列（date, open〜volume）のDataFrameに変換（列単位で丸め）
+
+    date_as_str=False なら日付を date 型のまま残す（Parquet出力用）。
+    """
+    frame = hist[list(OHLCV_COLUMNS.values())].round(2)
+    frame.columns = list(OHLCV_COLUMNS)
+    frame["volume"] = frame["volume"].round().astype("Int64")
+    frame.insert(0, "date", hist.index.strftime("%Y-%m-%d") if date_as_str else hist.index.date)
+    return frame.reset_index(drop=True)
+
+def history_to_records(hist):
+    """株価履歴のDataFrameを日付ごとのdictのリストに変換（欠損は None）"""
+    records = history_to_frame(hist)
+    records = records.astype(object).where(records.notna(), None)
+    return records.to_dict(orient="records")
+
+def fetch_stock_history(code, as_frame=False):
     """
     指定された証券コードの株価履歴を取得
 
     Args:
         code: 証券コード（例: 7203）
+        as_frame: True なら data をdictのリストではなくDataFrameで返す（Parquet出力用）
 
     Returns:
         dict: 株価履歴データ or None（エラー時）
@@ -46,23 +107,21 @@ def fetch_stock_history(code):
 
     for attempt in range(MAX_RETRIES):
         try:
-            ticker = yf.Ticker(ticker_symbol)
+            if YF_SESSION is not None:
+                ticker = yf.Ticker(ticker_symbol, session=YF_SESSION)
+            else:
+                ticker = yf.Ticker(ticker_symbol)
             hist = ticker.history(period=HISTORY_PERIOD)
 
             if hist.empty:
                 return None
 
-            # DataFrameをリスト形式に変換
-            data_list = []
-            for date, row in hist.iterrows():
-                data_list.append({
-                    "date": date.strftime("%Y-%m-%d"),
-                    "open": round(float(row['Open']), 2) if pd.notna(row['Open']) else None,
-                    "high": round(float(row['High']), 2) if pd.notna(row['High']) else None,
-                    "low": round(float(row['Low']), 2) if pd.notna(row['Low']) else None,
-                    "close": round(float(row['Close']), 2) if pd.notna(row['Close']) else None,
-                    "volume": int(row['Volume']) if pd.notna(row['Volume']) else None
-                })
+            hist = shrink_history(hist)
+
+            if as_frame:
+                data_list = history_to_frame(hist, date_as_str=False)
+            else:
+                data_list = history_to_records(hist)
 
             result = {
                 "code": code,
@@ -83,13 +142,29 @@ def fetch_stock_history(code):
 
     return None
 
-def save_to_json(data, code):
+# JSONの書き出しはorjsonがあれば高速に処理（なければ標準のjson）、既定は空白なしの1行
+try:
+    import orjson
+
+    def json_dumps(data, pretty=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+except ImportError:
+    def json_dumps(data, pretty=False):
+        if pretty:
+            return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def save_to_json(data, code, pretty=False):
     """
     データをJSON形式で保存
 
     Args:
         data: 株価履歴データ
         code: 証券コード
+        pretty: True ならインデント付きで出力
     """
     if data is None:
         return False
@@ -97,16 +172,62 @@ def save_to_json(data, code):
     output_file = os.path.join(OUTPUT_DIR, f"{code}.json")
 
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(json_dumps(data, pretty))
+        return True
+    except Exception as e:
+        return False
+
+def save_to_parquet(data, code):
+    """
+    データをParquet形式（zstd圧縮）で保存
+
+    JSON出力と同じ code / ticker / last_updated / period / data_points は
+    スキーマのメタデータに保存する（pyarrow.parquet.read_schema(path).metadata で読める）。
+
+    Args:
+        data: 株価履歴データ（data がDataFrameのもの）
+        code: 証券コード
+    """
+    if data is None:
+        return False
+
+    output_file = os.path.join(OUTPUT_DIR, f"{code}.parquet")
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(data["data"], preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata.update({
+            key.encode(): str(value).encode()
+            for key, value in data.items() if key != "data"
+        })
+        pq.write_table(table.replace_schema_metadata(metadata), output_file, compression='zstd')
         return True
     except Exception as e:
         return False
 
-def process_company(code):
+def find_fresh_codes(output_dir, hours, suffix='.json'):
+    """保存から hours 時間以内の出力ファイルがある証券コードを返す（ディレクトリを1回走査）"""
+    cutoff = time.time() - hours * 3600
+    try:
+        with os.scandir(output_dir) as entries:
+            return {
+                entry.name[:-len(suffix)]
+                for entry in entries
+                if entry.name.endswith(suffix) and entry.stat().st_mtime > cutoff
+            }
+    except FileNotFoundError:
+        return set()
+
+def process_company(code, pretty=False, parquet=False):
     """並列処理用のラッパー関数"""
-    data = fetch_stock_history(code)
-    success = save_to_json(data, code)
+    if parquet:
+        success = save_to_parquet(fetch_stock_history(code, as_frame=True), code)
+    else:
+        success = save_to_json(fetch_stock_history(code), code, pretty)
 
     # スレッドセーフにカウンターを更新
     with lock:
@@ -119,6 +240,18 @@ def process_company(code):
     return {"code": code, "success": success}
 
 def main():
+    parser = argparse.ArgumentParser(description='Japan IR - 株価履歴データ取得スクリプト（並列処理版）')
+    parser.add_argument('--pretty', action='store_true', help='JSONをインデント付きで出力（既定は空白なし）')
+    parser.add_argument('--force', action='store_true', help=f'{FRESH_HOURS:g}時間以内に取得済みの企業も再取得')
+    parser.add_argument('--parquet', action='store_true', help='JSONの代わりにParquet（{code}.parquet）で出力')
+    args = parser.parse_args()
+
+    # Parquet出力には pyarrow が必要（なければJSON出力で続行）
+    if args.parquet and importlib.util.find_spec('pyarrow') is None:
+        print("⚠️  pyarrow未インストールのため、JSONで出力します")
+        args.parquet = False
+    output_suffix = '.parquet' if args.parquet else '.json'
+
     print("=" * 70)
     print("Japan IR - 株価履歴データ取得（並列処理版）")
     print("=" * 70)
@@ -126,7 +259,7 @@ def main():
     print(f"並列数: {MAX_WORKERS}")
     print()
 
-    start_time = datetime.now()
+    start_clock = time.monotonic()  # 経過時間は単調時計で計測（日時の整形は開始・完了時のみ）
 
     # 出力ディレクトリ作成
     Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
@@ -151,6 +284,21 @@ def main():
 
     df = pd.read_csv(input_csv)
     stock_codes = df['code'].tolist()
+
+    # 直近に取得済みの企業はスキップ（--force で全件取得）
+    fresh_skipped = 0
+    if not args.force:
+        fresh_codes = find_fresh_codes(OUTPUT_DIR, FRESH_HOURS, output_suffix)
+        before = len(stock_codes)
+        stock_codes = [code for code in stock_codes if str(code) not in fresh_codes]
+        fresh_skipped = before - len(stock_codes)
+        if fresh_skipped:
+            print(f"⏭️  {FRESH_HOURS:g}時間以内に取得済みの{fresh_skipped}社をスキップ")
+
+    if not stock_codes:
+        print("✅ 取得が必要な企業はありません")
+        return
+
     total = len(stock_codes)
 
     num_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
@@ -164,17 +312,19 @@ def main():
     print()
 
     last_progress_print = 0
+    progress_bar = tqdm(total=total, desc="Fetching", unit="ticker", mininterval=5) if tqdm is not None else None
 
     # バッチ処理（API制限対策）
     batches = [stock_codes[i:i + BATCH_SIZE] for i in range(0, len(stock_codes), BATCH_SIZE)]
     total_batches = len(batches)
 
-    for batch_idx, batch in enumerate(batches, 1):
-        print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
+    # スレッドは全バッチで使い回す（バッチごとにプールを作り直さない）
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for batch_idx, batch in enumerate(batches, 1):
+            print(f"--- バッチ {batch_idx}/{total_batches} ({len(batch)}社) ---")
 
-        # 並列処理
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_code = {executor.submit(process_company, code): code for code in batch}
+            # 並列処理
+            future_to_code = {executor.submit(process_company, code, args.pretty, args.parquet): code for code in batch}
 
             for future in as_completed(future_to_code):
                 try:
@@ -186,8 +336,11 @@ def main():
 
                 # 進捗表示
                 current_total = progress_counter["total"]
-                if current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
-                    elapsed = (datetime.now() - start_time).total_seconds()
+                if progress_bar is not None:
+                    progress_bar.set_postfix(ok=progress_counter['success'], err=progress_counter['error'], refresh=False)
+                    progress_bar.update(1)
+                elif current_total - last_progress_print >= PROGRESS_INTERVAL or current_total == total:
+                    elapsed = time.monotonic() - start_clock
                     if current_total > 0:
                         eta = (elapsed / current_total) * (total - current_total) / 60
                     else:
@@ -195,14 +348,17 @@ def main():
                     print(f"[{current_total:4}/{total}] ✅ {progress_counter['success']} / ❌ {progress_counter['error']} | 経過: {elapsed/60:.1f}分 | ETA: {eta:.0f}分")
                     last_progress_print = current_total
 
-        # バッチ間の待機（最後のバッチ以外）
-        if batch_idx < total_batches:
-            print(f"    💤 {BATCH_DELAY}秒待機...")
-            time.sleep(BATCH_DELAY)
+            # バッチ間の待機（最後のバッチ以外）
+            if batch_idx < total_batches:
+                print(f"    💤 {BATCH_DELAY}秒待機...")
+                time.sleep(BATCH_DELAY)
+
+    if progress_bar is not None:
+        progress_bar.close()
 
     # 完了サマリー
     end_time = datetime.now()
-    elapsed = (end_time - start_time).total_seconds()
+    elapsed = time.monotonic() - start_clock
 
     success_count = progress_counter["success"]
     error_count = progress_counter["error"]
@@ -213,8 +369,10 @@ def main():
     print(f"所要時間: {elapsed/60:.1f}分 ({elapsed:.0f}秒)")
     print(f"成功: {success_count}社 ({success_count/total*100:.1f}%)")
     print(f"失敗: {error_count}社")
+    if fresh_skipped:
+        print(f"取得済みのためスキップ: {fresh_skipped}社")
     print(f"並列数: {MAX_WORKERS}")
-    print(f"出力先: {OUTPUT_DIR}/")
+    print(f"出力先: {OUTPUT_DIR}/（{output_suffix[1:]}）")
     print("=" * 70)
 
 if __name__ == "__main__":
@@ -14,6 +14,7 @@ import base64
 import argparse
 import requests
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 # 設定
@@ -26,8 +27,9 @@ REQUEST_DELAY = 0.3
 PROGRESS_INTERVAL = 10
 
 
+@lru_cache(maxsize=None)
 def get_auth_headers():
-    """WordPress REST API認証ヘッダー"""
+    """WordPress REST API認証ヘッダー（初回のみ生成）"""
     if not WP_USER or not WP_PASSWORD:
         raise ValueError("❌ エラー: WP_USER と WP_PASSWORD 環境変数を設定してください")
 